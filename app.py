@@ -5,8 +5,8 @@ from flask import (
     redirect,
     url_for,
     session,
-    send_from_directory,
-    jsonify,
+    Response,
+    stream_with_context,
 )
 from flask_login import (
     LoginManager,
@@ -16,28 +16,39 @@ from flask_login import (
     UserMixin,
     current_user,
 )
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, date
 
-from kuma_client import load_monitors
-from status_client import load_status, process_monitor
+from dashboard_data import build_dashboard_data
 from auth import verify_user, verify_totp
 from config import (
-    KUMA1,
-    KUMA2,
-    KUMA3,
+    METRICS_ALLOWED_IPS,
+    METRICS_TOKEN,
     NODEPING,
     PUSH_ENABLED,
     PUSH_VAPID_PUBLIC_KEY,
-    PUSH_NOTIFY_ON,
+    SSE_HEARTBEAT,
 )
-from push_utils import (
-    add_subscription,
-    send_push_to_all,
-    load_subscriptions,
-    save_subscriptions
+from push_utils import add_subscription, remove_subscription
+from redis_history import (
+    load_snapshot,
+    load_snapshot_raw,
+    load_changes_since,
+    get_snapshot_version,
+    get_snapshot_published,
 )
-from redis_history import get_global_state, set_global_state
-import os, random
+from live_updates import broadcaster
+from history_rollup import query_history
+from uptime_stats import uptime_report, month_start
+from kuma_client import normalize
+from probes import probe_headers
+from static_assets import AssetManifest, IMMUTABLE_CACHE_CONTROL
+from metrics import (
+    RENDER,
+    SnapshotAgeCollector,
+    metrics_payload,
+    register_scrape_collector,
+)
+import os, json, hashlib, hmac, queue, time
 
 app = Flask(__name__)
 app.secret_key = (
@@ -51,9 +62,19 @@ login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = "login"
 
-# Stato globale precedente
-LAST_GLOBAL_STATE = None
+# Asset statici versionati con l'hash del contenuto, calcolato all'avvio
+ASSETS = AssetManifest(os.path.join(app.root_path, "static"))
+app.jinja_env.globals["asset_url"] = ASSETS.url
+
 
+@app.after_request
+def cache_static_assets(resp):
+    # URL con l'hash corrente → cache immutabile; il resto si rivalida
+    if request.endpoint == "static" and ASSETS.is_current(
+        (request.view_args or {}).get("filename"), request.args.get("v")
+    ):
+        resp.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+    return resp
 
 # ============================================================================
 # MODELLO UTENTE
@@ -124,72 +145,24 @@ def logout():
 
 
 # ============================================================================
-# HELPER
+# SNAPSHOT DASHBOARD
 # ============================================================================
-def map_status(x):
-    return "DOWN" if x == 0 else "UP"
-
-
-def extract_monitor_url(name, statuses):
-    import re
-
-    m = re.search(r"-\s*(https?://)?([\w.-]+\.\w+)", name)
-    if not m:
-        return None
-
-    domain = m.group(2)
-
-    for url in statuses.keys():
-        if domain in url:
-            return url
-    return None
-
-
-# ============================================================================
-# COSTRUZIONE DATI DASHBOARD
-# ============================================================================
-def build_dashboard_data():
-    m1 = load_monitors(KUMA1["host"], KUMA1["slug"])
-    m2 = load_monitors(KUMA2["host"], KUMA2["slug"])
-    m3 = load_monitors(KUMA3["host"], KUMA3["slug"])
-    common = sorted(set(m1.keys()) & set(m2.keys()) & set(m3.keys()))
-
-    statuses = load_status()
-
-    rows = []
-    for name_norm in common:
-        display = m1[name_norm]
-        p = process_monitor(display, statuses, name_norm)
-
-        rows.append(
-            {
-                "name": display,
-                "k1": map_status(p["bg"]),
-                "k2": map_status(p["tim"]),
-                "k3": map_status(p["iliad"]),
-                "n1": map_status(p["nodeping"]),
-                "final": map_status(p["final"]),
-                "severity": p["severity"],
-                "history": p["history"],
-                "link": extract_monitor_url(display, statuses),
-            }
-        )
-
-    rows.sort(key=lambda x: 0 if x["final"] == "DOWN" else 1)
+def get_dashboard_snapshot():
+    """
+    Ritorna lo snapshot pubblicato dal worker; se manca (worker fermo o
+    snapshot scaduto) ricalcola i dati direttamente dalle sorgenti.
+    """
+    snapshot = load_snapshot()
+    if snapshot is not None:
+        return snapshot
 
-    any_final_down = any(r["final"] == "DOWN" for r in rows)
-    any_mismatch = any(
-        len({r["k1"], r["k2"], r["k3"], r["n1"]}) > 1 and (r["final"] != "DOWN") for r in rows
-    )
-
-    if any_final_down:
-        global_state = "RED"
-    elif any_mismatch:
-        global_state = "YELLOW"
-    else:
-        global_state = "GREEN"
-
-    return rows, global_state
+    rows, global_state = build_dashboard_data()
+    return {
+        "version": None,
+        "items": rows,
+        "global_state": global_state,
+        "timestamp": datetime.now().isoformat(),
+    }
 
 
 # ============================================================================
@@ -197,8 +170,17 @@ def build_dashboard_data():
 # ============================================================================
 @app.route("/sw.js")
 def service_worker():
-    swdir = os.path.join(app.root_path, "static", "js")
-    return send_from_directory(swdir, "sw.js", mimetype="application/javascript")
+    resp = Response(
+        render_template(
+            "sw.js",
+            cache_version=ASSETS.version,
+            precache=ASSETS.precache_urls(),
+        ),
+        mimetype="application/javascript",
+    )
+    # Il browser deve sempre rivalidare lo script del service worker
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
 
 
 # ============================================================================
@@ -224,61 +206,20 @@ def push_unsubscribe():
     if not endpoint:
         return {"ok": False, "error": "missing endpoint"}, 400
 
-    subs = load_subscriptions()
-    new_subs = [s for s in subs if s.get("endpoint") != endpoint]
+    removed = remove_subscription(endpoint)
 
-    save_subscriptions(new_subs)
-
-    return {"ok": True, "removed": True}
+    return {"ok": True, "removed": removed}
 
 # ============================================================================
 # DASHBOARD
 # ============================================================================
 @app.route("/")
 @login_required
+@RENDER.labels("dashboard").time()
 def dashboard():
-    rows, global_state = build_dashboard_data()
-
-    # ---- Notifiche push basate su transizione di stato globale ----
-    previous = get_global_state()
-    set_global_state(global_state)  # aggiorniamo sempre lo stato in Redis
-
-    if PUSH_ENABLED and previous is not None:
-        # 1) DOWN definitivo (RED)
-        if (
-            PUSH_NOTIFY_ON.get("final_down", False)
-            and previous != "RED"
-            and global_state == "RED"
-        ):
-            send_push_to_all(
-                "🔔 Servizio IN.VA DOWN",
-                "Una o più risorse risultano DOWN su entrambe le sonde.",
-                {"state": "RED"},
-            )
-
-        # 2) Mismatch tra sonde (YELLOW)
-        if (
-            PUSH_NOTIFY_ON.get("probe_mismatch", False)
-            and previous != "YELLOW"
-            and global_state == "YELLOW"
-        ):
-            send_push_to_all(
-                "🔔 Incongruenza tra sonde",
-                "Una o più risorse hanno stato diverso tra le sonde.",
-                {"state": "YELLOW"},
-            )
-
-        # 3) Ritorno a tutto OK (GREEN)
-        if (
-            PUSH_NOTIFY_ON.get("back_to_green", False)
-            and previous in ("RED", "YELLOW")
-            and global_state == "GREEN"
-        ):
-            send_push_to_all(
-                "✅ IN.VA – tutto OK",
-                "Tutte le risorse risultano UP su entrambe le sonde.",
-                {"state": "GREEN"},
-            )
+    # Sola lettura: transizioni di stato e notifiche sono del worker
+    snapshot = get_dashboard_snapshot()
+    rows, global_state = snapshot["items"], snapshot["global_state"]
 
     return render_template(
         "dashboard.html",
@@ -286,17 +227,193 @@ def dashboard():
         global_state=global_state,
         current_year=datetime.now().year,
         vapid_public_key=PUSH_VAPID_PUBLIC_KEY if PUSH_ENABLED else "",
-        randomize_version=random.randint(159827789,654987987),
+        probes=probe_headers(),
     )
 
 
 # ============================================================================
 # API JSON
 # ============================================================================
+def _json_response(body, etag):
+    resp = Response(body, mimetype="application/json")
+    resp.set_etag(etag)
+    # Il client rivalida sempre, ma con If-None-Match
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+
+def _not_modified(etag):
+    resp = Response(status=304)
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+
 @app.route("/api/dashboard-data")
 @login_required
+@RENDER.labels("api_dashboard_data").time()
 def api_dashboard_data():
+    # Snapshot invariato → 304 senza leggere né serializzare il payload
+    version = get_snapshot_version()
+    if version is not None and request.if_none_match.contains(f"v{version}"):
+        return _not_modified(f"v{version}")
+
+    # ?since=versione → solo i change-set successivi (righe cambiate, nuovi
+    # punti di storico); payload completo se il client è troppo indietro
+    since = request.args.get("since", type=int)
+    if since is not None and version is not None:
+        chain = load_changes_since(since)
+        if chain:
+            last = chain[-1]
+            body = json.dumps(
+                {
+                    "mode": "delta",
+                    "since": since,
+                    "version": last["version"],
+                    "global_state": last["global_state"],
+                    "timestamp": last["timestamp"],
+                    "changes": chain,
+                }
+            )
+            return _json_response(body, f"v{last['version']}")
+
+    # Snapshot del worker: il JSON in Redis viene servito così com'è
+    version, raw = load_snapshot_raw()
+    if raw:
+        etag = f"v{version}"
+        if request.if_none_match.contains(etag):
+            return _not_modified(etag)
+        return _json_response(raw, etag)
+
+    # Fallback: ETag dall'hash del contenuto (timestamp escluso)
     rows, global_state = build_dashboard_data()
-    return jsonify(
-        {"items": rows, "global_state": global_state, "timestamp": datetime.now().isoformat()}
-    )
\ No newline at end of file
+    content = json.dumps([rows, global_state])
+    etag = "h" + hashlib.sha256(content.encode("utf-8")).hexdigest()[:32]
+    if request.if_none_match.contains(etag):
+        return _not_modified(etag)
+
+    return _json_response(
+        json.dumps(
+            {
+                "version": None,
+                "items": rows,
+                "global_state": global_state,
+                "timestamp": datetime.now().isoformat(),
+            }
+        ),
+        etag,
+    )
+
+
+# ============================================================================
+# STORICO AGGREGATO
+# ============================================================================
+@app.route("/api/history")
+@login_required
+def api_history():
+    """
+    Storico di un monitor su un intervallo qualsiasi, dagli aggregati.
+    Parametri: name (nome monitor), start/end (epoch, default ultime 24 ore),
+    tier opzionale (minute/hour/day; default scelto in base all'intervallo).
+    """
+    name = request.args.get("name", "").strip()
+    if not name:
+        return {"ok": False, "error": "missing name"}, 400
+
+    end = request.args.get("end", type=int) or int(time.time())
+    start = request.args.get("start", type=int) or end - 86400
+    if start > end:
+        return {"ok": False, "error": "start after end"}, 400
+
+    try:
+        tier, start, buckets = query_history(normalize(name), start, end, request.args.get("tier"))
+    except ValueError as e:
+        return {"ok": False, "error": str(e)}, 400
+
+    # `start` è l'inizio effettivo (limitato a conservazione e numero di bucket)
+    return {"name": name, "tier": tier, "start": start, "end": end, "buckets": buckets}
+
+
+# ============================================================================
+# DISPONIBILITÀ (SLA)
+# ============================================================================
+@app.route("/api/uptime")
+@login_required
+def api_uptime():
+    """
+    Percentuali di disponibilità per monitor e per sonda.
+    Parametri: start/end (AAAA-MM-GG, default dal primo del mese a oggi),
+    name ripetibile per limitare il report ad alcuni monitor.
+    """
+    try:
+        start = date.fromisoformat(request.args.get("start") or month_start().isoformat())
+        end = date.fromisoformat(request.args.get("end") or date.today().isoformat())
+    except ValueError:
+        return {"ok": False, "error": "invalid date"}, 400
+    if start > end:
+        return {"ok": False, "error": "start after end"}, 400
+
+    names = [normalize(n) for n in request.args.getlist("name") if n.strip()]
+    return uptime_report(start, end, names or None)
+
+
+# ============================================================================
+# STREAM LIVE (SSE)
+# ============================================================================
+def stream_heartbeat():
+    version = get_snapshot_version()
+    published = get_snapshot_published()
+    age = round(time.time() - published, 1) if published else None
+    return json.dumps({"version": version, "age": age})
+
+
+@app.route("/api/stream")
+@login_required
+def api_stream():
+    def generate():
+        q = broadcaster.subscribe()
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    data = q.get(timeout=SSE_HEARTBEAT)
+                except queue.Empty:
+                    # Keepalive con versione ed età dello snapshot: il client
+                    # ricarica se è rimasto indietro o se il worker si è fermato
+                    yield f"event: heartbeat\ndata: {stream_heartbeat()}\n\n"
+                    continue
+                yield f"event: snapshot\ndata: {data}\n\n"
+        finally:
+            broadcaster.unsubscribe(q)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# ============================================================================
+# METRICHE PROMETHEUS
+# ============================================================================
+# Età dello snapshot calcolata a ogni scrape (+Inf se il worker è fermo)
+register_scrape_collector(SnapshotAgeCollector(get_snapshot_published))
+
+
+def metrics_allowed():
+    """Scrape ammesso da un indirizzo in allowlist o con il bearer token."""
+    if request.remote_addr in METRICS_ALLOWED_IPS:
+        return True
+    if not METRICS_TOKEN:
+        return False
+    auth = request.headers.get("Authorization", "")
+    return hmac.compare_digest(auth.encode(), f"Bearer {METRICS_TOKEN}".encode())
+
+
+@app.route("/metrics")
+def metrics():
+    if not metrics_allowed():
+        return Response("Forbidden\n", status=403, mimetype="text/plain")
+
+    body, content_type = metrics_payload()
+    return Response(body, mimetype=content_type)
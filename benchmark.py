@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+Benchmark della pipeline dashboard/worker con sorgenti locali finte.
+
+Avvia tre status page Uptime Kuma e un server status finti su 127.0.0.1,
+genera da 10 a 10.000 monitor con una quota configurabile di sonde DOWN e
+misura le singole fasi (fetch, match, severità, storico, serializzazione)
+oltre a build_dashboard_data e history_worker.loop_once.
+
+Il risultato è un JSON (tempi in ms, allocazioni da tracemalloc) da
+confrontare tra revisioni:
+
+    python benchmark.py --sizes 10,100,1000,10000 --output bench.json
+
+Redis: di default fakeredis in memoria; con --redis local il Redis di
+config.py sul database --redis-db (svuotato a ogni dimensione!).
+"""
+
+import argparse
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import config
+
+_SLUG = "bench"
+
+
+# ============================================================================
+# SORGENTI FINTE
+# ============================================================================
+class FakeSources:
+    """
+    Status page Kuma (GET /api/status-page/{slug}) e server status
+    (POST /status) con payload pre-generati e latenza configurabile.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.kuma_body = b"{}"
+        self.status_body = b"{}"
+        self._servers = []
+
+    def generate(self, count, down_rate, mismatch_rate, seed):
+        """Genera `count` monitor: una quota tutta DOWN, una in mismatch."""
+        rnd = random.Random(seed)
+        probes = [probe for _, probe, _ in config.PROBES]
+
+        monitors, statuses = [], {}
+        for i in range(count):
+            name = f"Servizio {i:05d} - https://svc{i}.bench.local"
+            monitors.append({"id": i, "name": name})
+
+            x = rnd.random()
+            if x < down_rate:
+                down = list(probes)
+            elif x < down_rate + mismatch_rate:
+                down = rnd.sample(probes, rnd.randint(1, len(probes) - 1))
+            else:
+                down = []
+            statuses[f"https://svc{i}.bench.local/"] = {"last_name": name, "probes": down}
+
+        self.kuma_body = json.dumps(
+            {"publicGroupList": [{"name": "Bench", "monitorList": monitors}]}
+        ).encode()
+        self.status_body = json.dumps(statuses).encode()
+
+    def _handler(self):
+        sources = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, body):
+                if sources.latency:
+                    time.sleep(sources.latency)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path == f"/api/status-page/{_SLUG}":
+                    self._reply(sources.kuma_body)
+                else:
+                    self.send_error(404)
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                self._reply(sources.status_body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self, instances=3):
+        """Avvia `instances` server Kuma più il server status; ritorna gli host."""
+        hosts = []
+        for _ in range(instances + 1):
+            server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            self._servers.append(server)
+            hosts.append(f"127.0.0.1:{server.server_address[1]}")
+        return hosts[:instances], hosts[instances]
+
+    def stop(self):
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+
+
+# ============================================================================
+# CONFIGURAZIONE DI PROVA
+# ============================================================================
+def configure(kuma_hosts, status_host, args):
+    """
+    Punta config.py alle sorgenti finte. Va chiamata prima di importare i
+    moduli dell'app, che leggono la configurazione all'import.
+    """
+    config.KUMA_SCHEME = "http"
+    config.KUMA_SOURCES = [
+        {"name": f"Kuma bench {i + 1}", "host": host, "slug": _SLUG}
+        for i, host in enumerate(kuma_hosts)
+    ]
+    config.STATUS_URL = f"http://{status_host}/status"
+
+    # Ogni ciclo scarica davvero l'elenco monitor (niente cache)
+    config.KUMA_MONITORS_TTL = 0
+    config.KUMA_MONITORS_MAX_STALE = 0
+
+    # Nessuna notifica e nessuna porta metriche durante le misure
+    config.PUSH_ENABLED = False
+    config.METRICS_WORKER_PORT = None
+
+    if args.redis == "fake":
+        import fakeredis
+        import redis
+
+        server = fakeredis.FakeServer()
+        redis.Redis = lambda **kw: fakeredis.FakeRedis(
+            server=server, decode_responses=kw.get("decode_responses", False)
+        )
+    else:
+        config.REDIS_DB = args.redis_db
+
+
+# ============================================================================
+# MISURE
+# ============================================================================
+@contextmanager
+def _timed(samples, stage):
+    start = time.perf_counter()
+    yield
+    samples.setdefault(stage, []).append((time.perf_counter() - start) * 1000)
+
+
+@contextmanager
+def _allocated(allocs, stage):
+    """Picco (KiB) e blocchi allocati ancora vivi alla fine della fase."""
+    tracemalloc.reset_peak()
+    base, _ = tracemalloc.get_traced_memory()
+    before = tracemalloc.take_snapshot()
+    yield
+    _, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    allocs[stage] = {
+        "peak_kib": round((peak - base) / 1024, 1),
+        "net_blocks": sum(s.count_diff for s in after.compare_to(before, "filename")),
+    }
+
+
+def _summary(values):
+    return {
+        "min_ms": round(min(values), 3),
+        "median_ms": round(statistics.median(values), 3),
+        "mean_ms": round(statistics.fmean(values), 3),
+        "max_ms": round(max(values), 3),
+    }
+
+
+def run_size(count, args, sources):
+    from dashboard_data import (
+        LinkResolver,
+        build_dashboard_data,
+        build_rows,
+        finalize_rows,
+        load_upstream,
+    )
+    from history_worker import loop_once
+    from redis_history import r, load_histories, save_points, publish_snapshot
+    from status_client import index_status
+    from probes import probe_mask, evaluate
+
+    r.flushdb()
+    sources.generate(count, args.down_rate, args.mismatch_rate, args.seed)
+
+    # Un ciclo a vuoto: storico e snapshot precedenti come a regime
+    loop_once()
+
+    def stages(stage):
+        with stage("fetch"):
+            monitors, common, statuses, _ = load_upstream()
+
+        with stage("match"):
+            links = LinkResolver(statuses)
+            status_index = index_status(statuses)
+            for name_norm in common:
+                links.resolve(monitors[name_norm])
+
+        with stage("history_load"):
+            load_histories(common)
+
+        with stage("severity"):
+            masks = [probe_mask(status_index.get(n)) for n in common]
+            points = dict(zip(common, evaluate(masks)))
+
+        with stage("history_save"):
+            save_points(points)
+
+        rows = build_rows(monitors, common, statuses, links)
+        global_state = finalize_rows(rows)
+
+        with stage("serialize"):
+            json.dumps({"items": rows, "global_state": global_state})
+
+        with stage("publish"):
+            publish_snapshot(rows, global_state)
+
+        with stage("build_dashboard_data"):
+            build_dashboard_data()
+
+        with stage("loop_once"):
+            loop_once()
+
+    samples = {}
+    for _ in range(args.repeat):
+        stages(lambda name: _timed(samples, name))
+
+    result = {
+        "monitors": count,
+        "stages": {name: _summary(values) for name, values in samples.items()},
+    }
+
+    # Allocazioni in un passaggio separato: tracemalloc falsa i tempi
+    if not args.no_alloc:
+        allocs = {}
+        tracemalloc.start()
+        try:
+            stages(lambda name: _allocated(allocs, name))
+        finally:
+            tracemalloc.stop()
+        for name, alloc in allocs.items():
+            result["stages"][name]["alloc"] = alloc
+
+    return result
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return None
+
+
+# ============================================================================
+# MAIN
+# ============================================================================
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", default="10,100,1000,10000",
+                        help="numero di monitor, separati da virgola")
+    parser.add_argument("--sources", type=int, default=3, help="istanze Kuma finte")
+    parser.add_argument("--repeat", type=int, default=5, help="ripetizioni per dimensione")
+    parser.add_argument("--down-rate", type=float, default=0.01,
+                        help="quota di monitor DOWN su tutte le sonde")
+    parser.add_argument("--mismatch-rate", type=float, default=0.05,
+                        help="quota di monitor DOWN solo su alcune sonde")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="latenza aggiunta dalle sorgenti finte (secondi)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--redis", choices=("fake", "local"), default="fake")
+    parser.add_argument("--redis-db", type=int, default=15,
+                        help="database del Redis locale (viene svuotato)")
+    parser.add_argument("--no-alloc", action="store_true", help="salta le misure tracemalloc")
+    parser.add_argument("--output", help="file JSON di uscita (default: stdout)")
+    args = parser.parse_args()
+
+    sources = FakeSources(latency=args.latency)
+    kuma_hosts, status_host = sources.start(args.sources)
+    configure(kuma_hosts, status_host, args)
+
+    import logging
+    from history_worker import loop_once  # noqa: F401 (configura il logging)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    report = {
+        "revision": _git_revision(),
+        "timestamp": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "redis": args.redis,
+        "params": {
+            "sources": args.sources,
+            "repeat": args.repeat,
+            "down_rate": args.down_rate,
+            "mismatch_rate": args.mismatch_rate,
+            "latency": args.latency,
+            "seed": args.seed,
+        },
+        "results": [],
+    }
+
+    try:
+        for count in (int(x) for x in args.sizes.split(",")):
+            print(f"… {count} monitor", file=sys.stderr)
+            report["results"].append(run_size(count, args, sources))
+    finally:
+        sources.stop()
+
+    out = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(out + "\n")
+    else:
+        print(out)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,16 +8,43 @@ STATUS_URL   = "http://127.0.0.1:9000/status"
 
 HTTP_TIMEOUT = 10
 
+# Cache dell'elenco monitor delle istanze Kuma (secondi): entro il TTL
+# nessuna richiesta; tra TTL e MAX_STALE si serve la copia in cache e la si
+# rinnova in background (con ETag/Last-Modified); oltre si scarica subito
+KUMA_MONITORS_TTL = 300
+KUMA_MONITORS_MAX_STALE = 3600
+
+# Timeout della richiesta al server status (secondi)
+STATUS_TIMEOUT = 8
+
+# Fetch parallelo delle sorgenti upstream: budget complessivo (secondi)
+# e numero massimo di richieste contemporanee
+FETCH_BUDGET = 12
+FETCH_MAX_WORKERS = 8
+
 
 # ------------------------------------------------------------
 # MONITOR UPTIME KUMA
 # ------------------------------------------------------------
 
+# Schema delle richieste alle istanze Kuma ("http" solo per test/benchmark)
+KUMA_SCHEME = "https"
+
 PROBE_BG       = "Bergamo Aruba"
 PROBE_TIM      = "Sestu TIM"
 PROBE_ILIAD    = "Sinnai ILIAD"
 PROBE_NODEPING = "Europe NodePing"
 
+# Sonde mostrate in dashboard, in ordine di colonna:
+# (chiave nelle righe, nome della sonda nello status server, etichetta).
+# Una risorsa è DOWN solo se tutte le sonde la vedono DOWN
+PROBES = [
+    ("k1", PROBE_BG,       "Aruba Bergamo"),
+    ("k2", PROBE_TIM,      "TIM Sestu"),
+    ("k3", PROBE_ILIAD,    "ILIAD Sinnai"),
+    ("n1", PROBE_NODEPING, "NodePing Europe"),
+]
+
 KUMA1 = {
     "name": "Kuma Aruba Bergamo",
     "host": "monitor-bg.sundata.cloud",
@@ -36,6 +63,12 @@ KUMA3 = {
     "slug": "inva",
 }
 
+# Registro delle sorgenti Kuma: un monitor va in dashboard solo se è presente
+# in tutti i gruppi. Ogni sorgente ha "host" e "slug" (oppure "slugs": più
+# status page dello stesso host, unite). Il "group" facoltativo (default il
+# nome) unisce più istanze che coprono la stessa sonda, es. regionali
+KUMA_SOURCES = [KUMA1, KUMA2, KUMA3]
+
 NODEPING = {
     "name": "NodePing",
     "host": "nodeping.com",
@@ -54,12 +87,81 @@ REDIS_DB   = 0
 # Massimo 60 punti (1 ora con worker/cron ogni 60 secondi, o 10 minuti con intervalli 10s)
 MAX_HISTORY_POINTS = 60
 
-# Frequenza di aggiornamento del worker in secondi
+# Aggregati dello storico mantenuti dal worker a ogni ciclo:
+# (livello, ampiezza bucket in secondi, conservazione in secondi).
+# Ogni bucket contiene il conteggio dei punti per severità (0/1/2)
+HISTORY_ROLLUPS = [
+    ("minute", 60, 2 * 86400),        # 2 giorni
+    ("hour", 3600, 90 * 86400),       # 90 giorni
+    ("day", 86400, 2 * 365 * 86400),  # 2 anni
+]
+
+# Numero massimo di bucket restituiti da una query sullo storico: oltre
+# si passa automaticamente al livello più grossolano
+HISTORY_QUERY_MAX_BUCKETS = 500
+
+# Frequenza di aggiornamento del worker in secondi durante un incidente
+# (stato YELLOW/RED), per confermarlo più in fretta
 HISTORY_UPDATE_INTERVAL = 10
 
-# Hiostory sleep time for workers
+# Hiostory sleep time for workers: periodo dei cicli con tutto GREEN.
+# I cicli sono allineati ai multipli del periodo (orologio di sistema)
 SLEEP = 30
 
+# Cadenza adattiva: False → sempre SLEEP
+WORKER_ADAPTIVE = True
+
+# Più worker in alta affidabilità: scrive solo chi detiene il lease in Redis
+# (secondi), rinnovato in background ogni terzo di lease finché il ciclo
+# principale avanza. Gli standby riprovano ogni HISTORY_UPDATE_INTERVAL e
+# subentrano alla scadenza (anche se il leader resta bloccato)
+WORKER_LEASE = 15
+
+# Snapshot della dashboard pubblicato dal worker: scade dopo questo tempo
+# (secondi), così se il worker si ferma la web app torna al calcolo diretto
+SNAPSHOT_MAX_AGE = 3 * SLEEP
+
+# Change-set conservati per le richieste incrementali (?since=versione):
+# un client più indietro di così riceve il payload completo
+SNAPSHOT_DELTA_KEEP = 30
+
+# Contatori di disponibilità (secondi UP / mismatch / DOWN per giorno):
+# giorni conservati e intervallo massimo attribuito a un singolo ciclo
+# (oltre, ad esempio dopo un fermo del worker, il tempo non viene contato)
+UPTIME_RETENTION_DAYS = 400
+UPTIME_MAX_GAP = 3 * SLEEP
+
+# Stream live (SSE) /api/stream: intervallo dei keepalive in secondi.
+# Il keepalive porta versione ed età dello snapshot: senza snapshot (worker
+# fermo) i client tornano a chiedere i dati a ogni keepalive.
+# Ogni stream aperto occupa una connessione: con gunicorn usare worker
+# a thread o gevent, non i worker sync
+SSE_HEARTBEAT = 15
+
+# ------------------------------------------------------------
+# METRICHE PROMETHEUS
+# ------------------------------------------------------------
+# La web app le espone su /metrics; worker e dispatcher su una porta
+# dedicata (None = disabilitate)
+METRICS_WORKER_PORT = 9101
+METRICS_DISPATCHER_PORT = 9102
+# Indirizzo di ascolto di quelle porte (senza autenticazione): di default
+# solo locale; "0.0.0.0" per uno scraper remoto dietro firewall
+METRICS_BIND_ADDR = "127.0.0.1"
+
+# Accesso a /metrics della web app: indirizzi ammessi senza credenziali e
+# token per "Authorization: Bearer <token>" (None = solo indirizzi ammessi).
+# Dietro reverse proxy l'indirizzo è quello del proxy: usare il token.
+METRICS_ALLOWED_IPS = ["127.0.0.1", "::1"]
+METRICS_TOKEN = None
+
+# Gunicorn con più worker: esportare PROMETHEUS_MULTIPROC_DIR (cartella
+# vuota a ogni avvio) solo per la web app e, in gunicorn.conf.py,
+#   from prometheus_client import multiprocess
+#   def child_exit(server, worker):
+#       multiprocess.mark_process_dead(worker.pid)
+# Senza la variabile /metrics vede solo il processo che risponde.
+
 # ------------------------------------------------------------
 # PUSH NOTIFICATIONS
 # ------------------------------------------------------------
@@ -74,9 +176,29 @@ PUSH_VAPID_CLAIMS = {
     "sub": "mailto:assistenza@itcarmat.net"
 }
 
+# Invio push: richieste contemporanee e timeout per singolo endpoint (secondi)
+PUSH_CONCURRENCY = 8
+PUSH_TIMEOUT = 10
+
+# Coda notifiche consegnata da push_dispatcher.py
+PUSH_COALESCE_WINDOW = 60   # attesa (s) per accorpare eventi con la stessa chiave
+PUSH_QUEUE_TTL = 900        # messaggi più vecchi (s) vengono scartati
+PUSH_MAX_RETRIES = 5        # tentativi extra per gli endpoint falliti
+PUSH_RETRY_BASE = 10        # backoff esponenziale: 10, 20, 40, ... secondi
+PUSH_DISPATCH_POLL = 5      # attesa massima (s) tra due controlli della coda
+PUSH_INFLIGHT_TIMEOUT = 120 # consegna non confermata entro (s) → rimessa in coda
+
 # Politica notifiche (D)
 PUSH_NOTIFY_ON = {
     "final_down": True,      # rosso: entrambe le sonde rilevano DOWN
     "probe_mismatch": True,  # giallo: mismatch tra sonde
-    "back_to_green": True   # verde: tutto OK (puoi abilitarlo se vuoi)
+    "back_to_green": True,  # verde: tutto OK (puoi abilitarlo se vuoi)
+    # Notifiche per singolo monitor (confermate, senza flapping) al posto di
+    # quelle sullo stato globale; valgono le tre voci sopra per severità
+    "per_monitor": True,
 }
+
+# Transizioni per monitor (history_worker)
+MONITOR_CONFIRM_CYCLES = 2    # cicli consecutivi per confermare un nuovo stato
+MONITOR_FLAP_WINDOW = 600     # finestra (s) in cui si contano i cambi di stato
+MONITOR_FLAP_THRESHOLD = 4    # cambi nella finestra oltre cui il monitor è instabile
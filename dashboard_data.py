@@ -0,0 +1,182 @@
+# dashboard_data.py
+
+import re
+from functools import lru_cache
+
+from config import (
+    HTTP_TIMEOUT,
+    STATUS_TIMEOUT,
+)
+from fetcher import fetch_parallel
+from kuma_client import load_monitors
+from kuma_sources import source_pages, MonitorJoin
+from status_client import load_status, index_status
+from probes import PROBE_COLUMNS, probe_mask, evaluate, probe_columns
+from redis_history import load_histories
+from metrics import BUILD_DASHBOARD
+
+
+# ============================================================================
+# HELPER
+# ============================================================================
+# Dominio nel nome del monitor: "Servizio - https://www.example.com"
+_MONITOR_DOMAIN_RE = re.compile(r"-\s*(https?://)?([\w.-]+\.\w+)")
+
+# Host di un URL dello status server (schema opzionale)
+_URL_HOST_RE = re.compile(r"^(?:[a-z][\w+.-]*://)?([^/:?#\s]+)", re.IGNORECASE)
+
+
+@lru_cache(maxsize=4096)
+def monitor_domain(name):
+    """Estrae il dominio dal nome del monitor (None se assente)."""
+    m = _MONITOR_DOMAIN_RE.search(name)
+    return m.group(2).lower() if m else None
+
+
+class LinkResolver:
+    """
+    Risolve il link di ogni monitor verso un URL dello status server.
+
+    L'indice dominio → URL viene costruito una sola volta per snapshot
+    (host e domini padre, esclusa la TLD: www.example.com indicizza anche
+    example.com); i risultati restano memorizzati per nome monitor.
+    I monitor senza corrispondenza finiscono in `unmatched`.
+    """
+
+    def __init__(self, statuses):
+        self._index = {}
+        for url in statuses.keys():
+            m = _URL_HOST_RE.match(url)
+            if not m:
+                continue
+            labels = m.group(1).lower().split(".")
+            for i in range(len(labels) - 1):
+                # A parità di dominio vale il primo URL, come nella scansione lineare
+                self._index.setdefault(".".join(labels[i:]), url)
+
+        self._cache = {}
+        self.unmatched = set()
+
+    def resolve(self, name):
+        if name in self._cache:
+            return self._cache[name]
+
+        domain = monitor_domain(name)
+        url = self._index.get(domain) if domain else None
+        if url is None:
+            self.unmatched.add(name)
+
+        self._cache[name] = url
+        return url
+
+
+# ------------------------------------------------------
+# Determina stato globale: GREEN / YELLOW / RED
+# ------------------------------------------------------
+def compute_global_state(severities):
+    if any(sev == 2 for sev in severities):
+        return "RED"
+    if any(sev == 1 for sev in severities):
+        return "YELLOW"
+    return "GREEN"
+
+
+# ============================================================================
+# COSTRUZIONE RIGHE DASHBOARD
+# ============================================================================
+def load_upstream():
+    """
+    Scarica in parallelo i monitor da tutte le status page di KUMA_SOURCES
+    e lo stato dal server status. Ritorna (monitors, common, statuses, join):
+    monitors è la mappa { name_norm : display_name }, common l'elenco ordinato
+    dei monitor presenti in tutti i gruppi, join il MonitorJoin con i
+    contributi di ogni sorgente e i monitor mancanti.
+    """
+    pages = source_pages()
+    tasks = {
+        page_id: (HTTP_TIMEOUT, load_monitors, host, slug)
+        for page_id, _, host, slug in pages
+    }
+    tasks["status"] = (STATUS_TIMEOUT, load_status)
+
+    results, errors = fetch_parallel(tasks)
+
+    # Senza l'elenco monitor di una sorgente Kuma il confronto non è possibile
+    join = MonitorJoin(group for _, group, _, _ in pages)
+    for page_id, group, _, _ in pages:
+        if page_id in errors:
+            raise errors[page_id]
+        join.add(page_id, group, results[page_id])
+
+    # Lo status server non raggiungibile equivale a "tutto UP"
+    statuses = results.get("status", {})
+
+    return join.display, join.common(), statuses, join
+
+
+def build_rows(monitors, common, statuses, links=None):
+    """
+    Costruisce le righe della dashboard nello stesso ordine di `common`.
+    `links` è il LinkResolver dello snapshot (creato se non passato).
+    """
+    histories = load_histories(common)
+    status_index = index_status(statuses)
+    if links is None:
+        links = LinkResolver(statuses)
+
+    # Monitor assenti dallo status → tutte le sonde UP (maschera 0)
+    masks = [probe_mask(status_index.get(name_norm)) for name_norm in common]
+    severities = evaluate(masks)
+
+    rows = []
+    for name_norm, mask, severity in zip(common, masks, severities):
+        display = monitors[name_norm]
+        row = {"name": display}
+        row.update(probe_columns(mask))
+        row.update(
+            final="DOWN" if severity == 2 else "UP",
+            severity=severity,
+            history=histories[name_norm],
+            link=links.resolve(display),
+        )
+        rows.append(row)
+    return rows
+
+
+def finalize_rows(rows):
+    """
+    Ordina le righe (DOWN in cima) e ritorna lo stato globale.
+    """
+    rows.sort(key=lambda x: 0 if x["final"] == "DOWN" else 1)
+    return compute_global_state([r["severity"] for r in rows])
+
+
+# Campi di una riga che, se cambiati, finiscono nel change-set
+_ROW_FIELDS = (*PROBE_COLUMNS, "final", "severity", "link")
+
+
+def diff_rows(previous, rows):
+    """
+    Change-set tra le righe dello snapshot precedente e quelle nuove.
+    Le righe cambiate sono senza storico: il client aggiunge da sé il nuovo
+    punto (uguale alla severità) a ogni riga non nuova.
+    """
+    prev = {p["name"]: p for p in previous}
+    changed, added = [], []
+
+    for row in rows:
+        old = prev.pop(row["name"], None)
+        if old is None:
+            added.append(row)
+        elif any(old.get(f) != row[f] for f in _ROW_FIELDS):
+            changed.append({k: v for k, v in row.items() if k != "history"})
+
+    return {"changed": changed, "added": added, "removed": list(prev)}
+
+
+@BUILD_DASHBOARD.time()
+def build_dashboard_data():
+    monitors, common, statuses, _ = load_upstream()
+    rows = build_rows(monitors, common, statuses)
+    global_state = finalize_rows(rows)
+    return rows, global_state
@@ -0,0 +1,68 @@
+# fetcher.py
+
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from config import FETCH_BUDGET, FETCH_MAX_WORKERS
+
+# Pool condiviso da kuma_client e status_client: le richieste upstream
+# partono tutte insieme e un ciclo dura quanto la sorgente più lenta
+_executor = ThreadPoolExecutor(max_workers=FETCH_MAX_WORKERS, thread_name_prefix="fetch")
+
+
+def fetch_parallel(tasks, budget=FETCH_BUDGET):
+    """
+    Esegue in parallelo le richieste verso le sorgenti upstream.
+
+    tasks: { nome : (timeout, funzione, *args) }
+    Ogni funzione viene chiamata come funzione(*args, timeout=timeout) e ha
+    come deadline il proprio timeout, contato da quando parte davvero (con
+    più task che thread le ultime aspettano in coda senza consumarlo);
+    `budget` limita l'attesa complessiva.
+
+    Ritorna (results, errors): { nome : risultato } e { nome : eccezione }.
+    Le sorgenti che superano la deadline finiscono in errors con TimeoutError.
+    """
+    overall = time.monotonic() + budget
+    started = {}
+
+    def run(name, timeout, fn, args):
+        started[name] = time.monotonic()
+        return fn(*args, timeout=timeout)
+
+    pending = {}
+    for name, (timeout, fn, *args) in tasks.items():
+        pending[name] = (_executor.submit(run, name, timeout, fn, args), timeout)
+
+    results, errors = {}, {}
+
+    while pending:
+        now = time.monotonic()
+        next_check = overall
+
+        for name, (future, timeout) in list(pending.items()):
+            if future.done():
+                del pending[name]
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    errors[name] = e
+                continue
+
+            # Non ancora partita: la sua deadline non arriva prima di now + timeout
+            deadline = started.get(name, now) + timeout
+            if now >= min(deadline, overall):
+                del pending[name]
+                future.cancel()
+                errors[name] = TimeoutError(f"{name}: nessuna risposta entro la deadline")
+            else:
+                next_check = min(next_check, deadline)
+
+        if pending:
+            wait(
+                [future for future, _ in pending.values()],
+                timeout=max(0, next_check - time.monotonic()),
+                return_when=FIRST_COMPLETED,
+            )
+
+    return results, errors
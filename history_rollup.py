@@ -0,0 +1,99 @@
+# history_rollup.py
+
+import time
+
+from config import HISTORY_ROLLUPS, HISTORY_QUERY_MAX_BUCKETS
+from redis_history import r, write_pipeline, execute_writes
+from metrics import REDIS_OP
+
+# ------------------ AGGREGATI MULTI-RISOLUZIONE ------------------ #
+#
+# Un hash per livello e bucket: rollup:{livello}:{inizio}, con i campi
+# {name_norm}|c0/c1/c2 (punti per severità di ogni monitor). La severità
+# peggiore del bucket è la più alta con conteggio > 0. Ogni chiave scade da
+# sola alla fine della conservazione del suo livello. I bucket sono allineati
+# all'epoch (UTC).
+
+_TIERS = {name: (width, retention) for name, width, retention in HISTORY_ROLLUPS}
+
+_SEVERITIES = (0, 1, 2)
+
+
+def _rollup_key(tier, bucket):
+    return f"rollup:{tier}:{bucket}"
+
+
+def _fields(name_norm):
+    return [f"{name_norm}|c{sev}" for sev in _SEVERITIES]
+
+
+@REDIS_OP.labels("record_rollups").time()
+def record_rollups(points, ts=None, fence=None):
+    """
+    Aggiorna in modo incrementale gli aggregati di tutti i livelli con i
+    punti del ciclo { name_norm : severità }, in un'unica pipeline
+    (un EXPIREAT per livello).
+    """
+    if not points:
+        return
+    ts = int(ts if ts is not None else time.time())
+
+    pipe = write_pipeline(fence, transaction=False)
+    for tier, width, retention in HISTORY_ROLLUPS:
+        bucket = ts - ts % width
+        key = _rollup_key(tier, bucket)
+        for name_norm, severity in points.items():
+            pipe.hincrby(key, f"{name_norm}|c{severity}", 1)
+        pipe.expireat(key, bucket + width + retention)
+    execute_writes(pipe, fence)
+
+
+def pick_tier(start, end):
+    """
+    Livello più fine che copre [start, end] entro HISTORY_QUERY_MAX_BUCKETS
+    bucket e la cui conservazione arriva fino a `start`.
+    """
+    now = time.time()
+    for tier, width, retention in HISTORY_ROLLUPS:
+        if (end - start) / width <= HISTORY_QUERY_MAX_BUCKETS and start >= now - retention:
+            return tier
+    return HISTORY_ROLLUPS[-1][0]
+
+
+@REDIS_OP.labels("query_history").time()
+def query_history(name_norm, start, end, tier=None):
+    """
+    Storico aggregato di un monitor nell'intervallo [start, end] (epoch).
+    Ritorna (livello, inizio effettivo, bucket) con bucket =
+    [{"start", "worst", "counts"}] per i soli bucket con dati, in ordine
+    cronologico. L'inizio viene limitato alla conservazione del livello e
+    agli ultimi HISTORY_QUERY_MAX_BUCKETS bucket prima di `end`.
+    """
+    if tier is None:
+        tier = pick_tier(start, end)
+    if tier not in _TIERS:
+        raise ValueError(f"Livello sconosciuto: {tier}")
+
+    width, retention = _TIERS[tier]
+    start = max(int(start), int(time.time()) - retention)
+    end = int(end)
+
+    first = start - start % width
+    last = end - end % width
+    first = max(first, last - (HISTORY_QUERY_MAX_BUCKETS - 1) * width)
+    buckets = range(first, last + 1, width)
+
+    fields = _fields(name_norm)
+    pipe = r.pipeline(transaction=False)
+    for bucket in buckets:
+        pipe.hmget(_rollup_key(tier, bucket), fields)
+
+    result = []
+    for bucket, values in zip(buckets, pipe.execute()):
+        counts = [int(v or 0) for v in values]
+        if not any(counts):
+            continue
+        worst = max(sev for sev in _SEVERITIES if counts[sev] > 0)
+        result.append({"start": bucket, "worst": worst, "counts": counts})
+
+    return tier, max(first, start), result
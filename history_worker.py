@@ -1,82 +1,86 @@
 #!/usr/bin/env python3
 
+import math
 import time
 import logging
 
 from config import (
-    STATUS_URL,
-    STATUS_TOKEN,
-    KUMA1,
-    KUMA2,
-    KUMA3,
-    NODEPING,
     PUSH_ENABLED,
     PUSH_NOTIFY_ON,
-    PROBE_BG,
-    PROBE_TIM,
-    PROBE_ILIAD,
-    PROBE_NODEPING,
     SLEEP,
+    HISTORY_UPDATE_INTERVAL,
+    WORKER_ADAPTIVE,
+    UPTIME_MAX_GAP,
+    METRICS_WORKER_PORT,
+)
+from dashboard_data import LinkResolver, load_upstream, build_rows, finalize_rows, diff_rows
+from redis_history import (
+    save_points,
+    migrate_legacy_history,
+    swap_global_state,
+    load_snapshot,
+    publish_snapshot,
+)
+from history_rollup import record_rollups
+from uptime_stats import record_uptime
+from push_queue import enqueue_push
+from transitions import detect_transitions
+from leader import LeaderLease, LostLeadership
+from metrics import (
+    WORKER_CYCLE,
+    WORKER_LAG,
+    WORKER_SKIPPED_TICKS,
+    WORKER_ERRORS,
+    WORKER_LEADER,
+    observe_rows,
+    observe_sources,
+    serve_metrics,
 )
-from kuma_client import load_monitors
-from status_client import load_status
-from redis_history import save_point, get_global_state, set_global_state
-from push_utils import send_push_to_all
 
 logging.basicConfig(
     level=logging.INFO,
     format="[%(asctime)s] %(levelname)s - %(message)s"
 )
 
-
-# ------------------------------------------------------
-# Calcolo severità (0 verde, 1 giallo, 2 rosso)
-# ------------------------------------------------------
-def compute_severity(bg, tim, iliad, nodeping):
-    if bg == 1 and tim == 1 and iliad == 1 and nodeping == 1:
-        return 0
-    all_states = {bg, tim, iliad, nodeping}
-    if len(all_states) > 1:
-        return 1
-    return 2
-
-
-# ------------------------------------------------------
-# Determina stato globale: GREEN / YELLOW / RED
-# ------------------------------------------------------
-def compute_global_state(all_rows):
-    if any(sev == 2 for sev in all_rows):
-        return "RED"
-    if any(sev == 1 for sev in all_rows):
-        return "YELLOW"
-    return "GREEN"
+# Istante dell'ultimo ciclo completato (per i contatori di disponibilità)
+LAST_CYCLE_AT = None
 
 
 # ------------------------------------------------------
 # Notifiche push basate su transizioni stato globale
+# (accodate: le consegna push_dispatcher.py)
 # ------------------------------------------------------
-def maybe_send_global_push(new_state):
-    previous = get_global_state()
-    set_global_state(new_state)
+def maybe_send_global_push(new_state, lease=None):
+    # Unico punto di scrittura dello stato globale: lo scambio atomico
+    # (fenced) garantisce una sola notifica per transizione
+    if lease is not None:
+        lease.ensure()
+    previous = swap_global_state(new_state, fence=lease)
 
     # Primo avvio → niente notifiche
     if previous is None:
         return
 
-    # Push disabilitate
-    if not PUSH_ENABLED:
+    # Push disabilitate o sostituite da quelle per singolo monitor
+    if not PUSH_ENABLED or PUSH_NOTIFY_ON.get("per_monitor", False):
         return
 
+    # Token ricontrollato subito prima di accodare
+    if lease is not None:
+        lease.ensure()
+
     # 🔴 RED – finale DOWN
     if (
         PUSH_NOTIFY_ON.get("final_down", False)
         and previous != "RED"
         and new_state == "RED"
     ):
-        send_push_to_all(
+        enqueue_push(
             "🔴 Servizi DOWN",
             "Una o più risorse risultano DOWN su entrambe le sonde.",
             {"state": "RED"},
+            coalesce_key="global_state",
+            state="RED",
         )
 
     # 🟡 YELLOW – mismatch
@@ -85,10 +89,12 @@ def maybe_send_global_push(new_state):
         and previous != "YELLOW"
         and new_state == "YELLOW"
     ):
-        send_push_to_all(
+        enqueue_push(
             "🟡 Incongruenza tra sonde",
             "Una o più risorse hanno stato diverso tra le sonde.",
             {"state": "YELLOW"},
+            coalesce_key="global_state",
+            state="YELLOW",
         )
 
     # 🟢 GREEN – ritorno alla normalità
@@ -97,70 +103,153 @@ def maybe_send_global_push(new_state):
         and previous in ("RED", "YELLOW")
         and new_state == "GREEN"
     ):
-        send_push_to_all(
+        enqueue_push(
             "🟢 Tutto OK",
             "Tutte le risorse risultano UP su entrambe le sonde.",
             {"state": "GREEN"},
+            coalesce_key="global_state",
+            state="GREEN",
         )
 
 
 # ------------------------------------------------------
-# Ciclo unico del worker
+# Notifiche push per singolo monitor (eventi confermati)
 # ------------------------------------------------------
-def loop_once():
-    statuses = load_status()
+_SEVERITY_ICON = {0: "🟢", 1: "🟡", 2: "🔴"}
+_SEVERITY_TEXT = {0: "tornato OK", 1: "incongruenza tra sonde", 2: "DOWN"}
+_SEVERITY_POLICY = {0: "back_to_green", 1: "probe_mismatch", 2: "final_down"}
+
+# Righe massime nel corpo della notifica
+_MAX_EVENT_LINES = 5
+
+
+def maybe_send_monitor_push(events, monitors, lease=None):
+    if not events or not PUSH_ENABLED or not PUSH_NOTIFY_ON.get("per_monitor", False):
+        return
+
+    lines, names = [], []
+    for ev in events:
+        display = monitors.get(ev["name"], ev["name"])
+        if ev["type"] == "flapping":
+            lines.append(f"〰 {display}: instabile, notifiche sospese")
+            names.append(ev["name"])
+            continue
+        # Fine flapping sullo stesso stato già notificato → niente da dire
+        if ev["type"] == "stable" and ev["from"] == ev["to"]:
+            continue
+        if PUSH_NOTIFY_ON.get(_SEVERITY_POLICY[ev["to"]], False):
+            lines.append(f"{_SEVERITY_ICON[ev['to']]} {display}: {_SEVERITY_TEXT[ev['to']]}")
+            names.append(ev["name"])
+
+    if not lines:
+        return
 
-    m1 = load_monitors(KUMA1["host"], KUMA1["slug"])
-    m2 = load_monitors(KUMA2["host"], KUMA2["slug"])
-    m3 = load_monitors(KUMA3["host"], KUMA3["slug"])
+    title = lines[0] if len(lines) == 1 else f"🔔 {len(lines)} variazioni di stato"
+    body = "\n".join(lines[:_MAX_EVENT_LINES])
+    if len(lines) > _MAX_EVENT_LINES:
+        body += f"\n… e altre {len(lines) - _MAX_EVENT_LINES}"
 
-    common = sorted(set(m1.keys()) & set(m2.keys()) & set(m3.keys()))
-    severities = []
+    # Eventi già confermati e filtrati dal flapping: consegna immediata
+    if lease is not None:
+        lease.ensure()
+    # Solo i monitor mostrati: il payload Web Push non supera ~4 KB
+    enqueue_push(title, body, {"monitors": names[:_MAX_EVENT_LINES]}, delay=0)
 
-    # Nessun dato → tutto green
+
+# ------------------------------------------------------
+# Ciclo unico del worker
+# ------------------------------------------------------
+def loop_once(lease=None):
+    """
+    Un ciclo completo. Con `lease` (più worker in HA) tutte le scritture
+    Redis sono fenced sul token del leader e lease e token vengono
+    ricontrollati subito prima di stato globale e notifiche.
+    """
+    monitors, common, statuses, join = load_upstream()
+
+    # Contributo di ogni sorgente e monitor che mancano in qualche gruppo
+    missing = join.missing()
+    observe_sources(join, missing)
+    logging.info(
+        "Sorgenti Kuma: "
+        + ", ".join(f"{page}={count}" for page, count in join.contributed.items())
+        + f" → {len(common)} comuni"
+    )
+    for group, names in missing.items():
+        logging.info(f"Monitor assenti su {group}: {len(names)}")
+        logging.debug(f"Assenti su {group}: " + ", ".join(names))
+
+    # Nessun dato → tutto green (maschera sonde vuota, severità 0)
     if not statuses:
         logging.info("Status vuoto → tutti UP.")
 
-        for name_norm in common:
-            save_point(name_norm, 0)
-            severities.append(0)
-            logging.info(f"[ALL-UP] {m1[name_norm]} → sev=0")
+    links = LinkResolver(statuses)
+    rows = build_rows(monitors, common, statuses, links)
 
-        new_state = compute_global_state(severities)
-        maybe_send_global_push(new_state)
-        return
+    if links.unmatched:
+        logging.info(f"Monitor senza link nello status: {len(links.unmatched)}")
+        logging.debug("Senza link: " + ", ".join(sorted(links.unmatched)))
+
+    # Salva il nuovo punto di ogni monitor e lo aggiunge allo storico della
+    # riga, così lo snapshot pubblicato è già allineato a Redis
+    points = {name_norm: row["severity"] for name_norm, row in zip(common, rows)}
+    packed = save_points(points, fence=lease)
+
+    # Aggregati minuto/ora/giorno aggiornati al momento della scrittura
+    record_rollups(points, fence=lease)
+
+    # Contatori di disponibilità: il tempo dall'ultimo ciclo va allo stato attuale
+    global LAST_CYCLE_AT
+    now = time.time()
+    elapsed = SLEEP if LAST_CYCLE_AT is None else now - LAST_CYCLE_AT
+    LAST_CYCLE_AT = now
+    if elapsed <= UPTIME_MAX_GAP:
+        record_uptime(dict(zip(common, rows)), elapsed, now, fence=lease)
+    else:
+        logging.warning(f"Ciclo precedente {elapsed:.0f}s fa: tempo non conteggiato nell'uptime.")
+
+    for name_norm, row in zip(common, rows):
+        row["history"] = packed[name_norm]
+        logging.info(f"[OK] {row['name']} → sev={row['severity']}")
 
-    # Processa monitor
-    for name_norm in common:
-        display_name = m1[name_norm]
+    # Transizioni per monitor (solo i monitor cambiati o in sospeso)
+    events = detect_transitions(points, fence=lease)
+    for ev in events:
+        logging.info(f"[{ev['type'].upper()}] {monitors.get(ev['name'], ev['name'])}: {ev['from']} → {ev['to']}")
 
-        info = None
-        for url, data in statuses.items():
-            if data.get("last_name") == display_name:
-                info = data
-                break
+    # Calcola stato globale e pubblica lo snapshot per la web app,
+    # con il change-set rispetto al precedente per i client incrementali
+    new_state = finalize_rows(rows)
+    observe_rows(rows)
 
-        if not info:
-            bg = 1
-            tim = 1
-            iliad = 1
-            nodeping = 1
-        else:
-            probes = info.get("probes", [])
-            bg = 0 if PROBE_BG  in probes else 1
-            tim = 0 if PROBE_TIM in probes else 1
-            iliad = 0 if PROBE_ILIAD in probes else 1
-            nodeping = 0 if PROBE_NODEPING in probes else 1
+    previous = load_snapshot()
+    changes = None
+    if previous is not None:
+        changes = diff_rows(previous["items"], rows)
+        changes["from"] = previous["version"]
 
-        severity = compute_severity(bg, tim, iliad, nodeping)
-        severities.append(severity)
+    version = publish_snapshot(rows, new_state, changes, fence=lease)
+    logging.info(f"Snapshot v{version} pubblicato ({len(rows)} monitor, {new_state}).")
 
-        save_point(name_norm, severity)
-        logging.info(f"[OK] {display_name} → sev={severity}")
+    maybe_send_global_push(new_state, lease)
+    maybe_send_monitor_push(events, monitors, lease)
 
-    # Calcola stato globale
-    new_state = compute_global_state(severities)
-    maybe_send_global_push(new_state)
+    return new_state
+
+
+# ------------------------------------------------------
+# Scheduler a cadenza fissa (senza deriva)
+# ------------------------------------------------------
+def cycle_interval(state):
+    """Periodo del prossimo ciclo: più rapido durante un incidente."""
+    if WORKER_ADAPTIVE and state in ("YELLOW", "RED"):
+        return HISTORY_UPDATE_INTERVAL
+    return SLEEP
+
+
+def next_tick(now, interval):
+    """Primo istante successivo a `now` multiplo di `interval`."""
+    return (math.floor(now / interval) + 1) * interval
 
 
 # ------------------------------------------------------
@@ -168,14 +257,83 @@ def loop_once():
 # ------------------------------------------------------
 def main_loop():
     logging.info("=== Kuma History Worker avviato (con Push) ===")
-
-    while True:
-        try:
-            loop_once()
-        except Exception as e:
-            logging.exception(f"Errore worker: {e}")
-
-        time.sleep(SLEEP)
+    serve_metrics(METRICS_WORKER_PORT)
+
+    lease = LeaderLease()
+    lease.alive(2 * SLEEP)
+    lease.start_renewal()
+    logging.info(f"Nodo {lease.node_id}: in attesa del lease di leadership.")
+
+    migrated = None
+    state = None
+    tick = time.time()  # primo ciclo subito, poi allineati
+
+    try:
+        while True:
+            delay = tick - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+            started = time.time()
+            lag = started - tick
+
+            # Rinnovo in background solo finché il loop avanza (ciclo + attesa)
+            lease.alive(2 * cycle_interval(state))
+
+            # Standby: nessuna scrittura, si riprova al prossimo tick rapido
+            was_leader = lease.is_leader
+            try:
+                leader = lease.acquire()
+            except Exception as e:
+                logging.warning(f"Elezione leader non riuscita: {e}")
+                leader = False
+            WORKER_LEADER.set(1 if leader else 0)
+
+            if not leader:
+                if was_leader:
+                    logging.warning("Leadership persa: passo in standby.")
+                state = None
+                tick = next_tick(time.time(), HISTORY_UPDATE_INTERVAL)
+                continue
+            if not was_leader:
+                logging.info(f"Leader con token di fencing {lease.token}.")
+
+            # Conversione una tantum, solo da parte del leader
+            if migrated is None:
+                migrated = migrate_legacy_history()
+                if migrated:
+                    logging.info(f"Storico convertito nel formato compatto: {migrated} monitor.")
+
+            WORKER_LAG.observe(max(lag, 0))
+            if lag > 1:
+                logging.warning(f"Ciclo partito con {lag:.1f}s di ritardo.")
+
+            try:
+                state = loop_once(lease) or state
+            except LostLeadership:
+                logging.warning("Lease perso durante il ciclo: scritture interrotte.")
+            except Exception as e:
+                WORKER_ERRORS.inc()
+                logging.exception(f"Errore worker: {e}")
+
+            finished = time.time()
+            interval = cycle_interval(state)
+            duration = finished - started
+            WORKER_CYCLE.observe(duration)
+
+            # Tick successivo alla fine del ciclo: quelli già passati si saltano
+            following = next_tick(finished, interval)
+            skipped = max(0, round((following - tick) / interval) - 1)
+            WORKER_SKIPPED_TICKS.inc(skipped)
+            if duration > interval:
+                logging.warning(
+                    f"Ciclo di {duration:.1f}s oltre il periodo di {interval}s: {skipped} tick saltati."
+                )
+            tick = following
+            lease.alive(following - time.time() + 2 * interval)
+    finally:
+        # Arresto pulito: lo standby subentra al suo prossimo tick
+        lease.release()
 
 
 if __name__ == "__main__":
@@ -1,27 +1,112 @@
 # kuma_client.py
 
 import re
+import threading
+import time
 import requests
+from requests.adapters import HTTPAdapter
 from typing import Dict
-from config import HTTP_TIMEOUT
+from config import HTTP_TIMEOUT, KUMA_SCHEME, KUMA_MONITORS_TTL, KUMA_MONITORS_MAX_STALE
+from metrics import UPSTREAM_FETCH, UPSTREAM_ERRORS
+
+# Una sessione keep-alive per host: niente handshake TCP+TLS a ogni ciclo
+_sessions: Dict[str, requests.Session] = {}
+
+# Cache elenco monitor: (host, slug) → monitors, fetched_at, etag, last_modified
+_cache: Dict[tuple, dict] = {}
+_refreshing = set()
+_lock = threading.Lock()
+
 
 def normalize(name: str) -> str:
     """Normalizza i nomi per confronto."""
     return re.sub(r"\s+", " ", name.strip())
 
-def load_monitors(host: str, slug: str) -> Dict[str, str]:
+
+def get_session(host: str) -> requests.Session:
+    """Sessione HTTP persistente per un host Kuma."""
+    with _lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = requests.Session()
+            session.mount(f"{KUMA_SCHEME}://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+            _sessions[host] = session
+        return session
+
+
+def _fetch_monitors(host: str, slug: str, timeout: float) -> Dict[str, str]:
+    """
+    Scarica l'elenco monitor (richiesta condizionale se già in cache)
+    e aggiorna la cache.
+    """
+    key = (host, slug)
+    entry = _cache.get(key)
+
+    headers = {}
+    if entry and entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry and entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+
+    url = f"{KUMA_SCHEME}://{host}/api/status-page/{slug}"
+    with UPSTREAM_ERRORS.labels(host).count_exceptions(), UPSTREAM_FETCH.labels(host).time():
+        r = get_session(host).get(url, headers=headers, timeout=timeout)
+
+    if r.status_code == 304 and entry:
+        results = entry["monitors"]
+    else:
+        r.raise_for_status()
+        data = r.json()
+
+        results = {}
+
+        for group in data.get("publicGroupList", []):
+            for m in group.get("monitorList", []):
+                name_norm = normalize(m["name"])
+                results[name_norm] = m["name"]
+
+    with _lock:
+        _cache[key] = {
+            "monitors": results,
+            "fetched_at": time.monotonic(),
+            "etag": r.headers.get("ETag") or (entry or {}).get("etag"),
+            "last_modified": r.headers.get("Last-Modified") or (entry or {}).get("last_modified"),
+        }
+    return results
+
+
+def _refresh_in_background(host: str, slug: str, timeout: float) -> None:
+    key = (host, slug)
+    with _lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
+
+    def run():
+        try:
+            _fetch_monitors(host, slug, timeout)
+        except Exception as e:
+            print(f"⚠ Aggiornamento monitor {host}/{slug} fallito: {e}")
+        finally:
+            with _lock:
+                _refreshing.discard(key)
+
+    threading.Thread(target=run, name=f"kuma-refresh-{host}", daemon=True).start()
+
+
+def load_monitors(host: str, slug: str, timeout: float = HTTP_TIMEOUT) -> Dict[str, str]:
     """
     Ritorna { monitor_name_normalized : monitor_display_name_original }
+    L'elenco cambia di rado: viene servito dalla cache per KUMA_MONITORS_TTL
+    secondi e poi rinnovato in background fino a KUMA_MONITORS_MAX_STALE.
     """
-    url = f"https://{host}/api/status-page/{slug}"
-    r = requests.get(url, timeout=HTTP_TIMEOUT)
-    r.raise_for_status()
-    data = r.json()
-
-    results = {}
-
-    for group in data.get("publicGroupList", []):
-        for m in group.get("monitorList", []):
-            name_norm = normalize(m["name"])
-            results[name_norm] = m["name"]
-    return results
\ No newline at end of file
+    entry = _cache.get((host, slug))
+    if entry:
+        age = time.monotonic() - entry["fetched_at"]
+        if age < KUMA_MONITORS_TTL:
+            return entry["monitors"]
+        if age < KUMA_MONITORS_MAX_STALE:
+            _refresh_in_background(host, slug, timeout)
+            return entry["monitors"]
+
+    return _fetch_monitors(host, slug, timeout)
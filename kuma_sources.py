@@ -0,0 +1,62 @@
+# kuma_sources.py
+
+from config import KUMA_SOURCES
+
+
+def source_pages(sources=KUMA_SOURCES):
+    """
+    Status page da scaricare: lista di (id, gruppo, host, slug), una per
+    ogni slug di ogni sorgente. L'id è "host/slug".
+    """
+    pages = []
+    for src in sources:
+        group = src.get("group") or src["name"]
+        for slug in src.get("slugs") or [src["slug"]]:
+            pages.append((f"{src['host']}/{slug}", group, src["host"], slug))
+    return pages
+
+
+class MonitorJoin:
+    """
+    Join dei monitor tra gruppi di sorgenti, costruito una status page alla
+    volta su un solo indice { name_norm : bitmask dei gruppi che lo hanno }.
+    Un monitor è comune quando ha i bit di tutti i gruppi.
+
+    Il nome mostrato è quello della prima status page aggiunta che lo
+    contiene; `contributed` conta i monitor di ogni status page.
+    """
+
+    def __init__(self, groups):
+        self.groups = list(dict.fromkeys(groups))
+        self._bits = {g: 1 << i for i, g in enumerate(self.groups)}
+        self._full = (1 << len(self.groups)) - 1
+        self._mask = {}
+        self.display = {}
+        self.contributed = {}
+
+    def add(self, page_id, group, monitors):
+        bit = self._bits[group]
+        mask = self._mask
+        for name_norm, display in monitors.items():
+            if name_norm in mask:
+                mask[name_norm] |= bit
+            else:
+                mask[name_norm] = bit
+                self.display[name_norm] = display
+        self.contributed[page_id] = len(monitors)
+
+    def common(self):
+        """Monitor presenti in tutti i gruppi, in ordine alfabetico."""
+        full = self._full
+        return sorted(n for n, m in self._mask.items() if m == full)
+
+    def missing(self):
+        """{ gruppo : monitor assenti lì ma presenti altrove } (solo gruppi con assenze)."""
+        result = {}
+        for name_norm, m in self._mask.items():
+            if m == self._full:
+                continue
+            for group, bit in self._bits.items():
+                if not m & bit:
+                    result.setdefault(group, []).append(name_norm)
+        return {g: sorted(result[g]) for g in self.groups if g in result}
@@ -0,0 +1,156 @@
+# leader.py
+
+import logging
+import os
+import socket
+import threading
+import time
+
+import redis
+
+from config import WORKER_LEASE
+from redis_history import r
+
+# ------------------ ELEZIONE DEL LEADER ------------------ #
+#
+# Il lease `worker:leader` (SET NX PX) vale "nodo:token". Il token di
+# fencing è un INCR su `worker:leader:token` a ogni nuova acquisizione: le
+# scritture fenced fanno WATCH su quella chiave, così quelle di un ex leader
+# (es. processo rimasto sospeso oltre il lease) vengono scartate.
+
+_LEASE_KEY = "worker:leader"
+_TOKEN_KEY = "worker:leader:token"
+
+# Acquisizione: lease e nuovo token insieme
+_ACQUIRE = r.register_script("""
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+    local token = redis.call('INCR', KEYS[2])
+    redis.call('SET', KEYS[1], ARGV[1] .. ':' .. token, 'PX', ARGV[2])
+    return token
+end
+return false
+""")
+
+# Rinnovo / rilascio solo se il lease è ancora nostro
+_RENEW = r.register_script("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+""")
+
+_RELEASE = r.register_script("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+""")
+
+
+class LostLeadership(Exception):
+    """Il lease è passato a un altro worker: le scritture vanno interrotte."""
+
+
+class LeaderLease:
+    """
+    Lease di leadership per history_worker. `acquire()` a ogni tick: rinnova
+    se già leader, altrimenti prova a prendere il lease libero. Un thread
+    rinnova il lease tra un ciclo e l'altro, solo finché il main loop
+    segnala di essere vivo con `alive()`.
+    """
+
+    def __init__(self, node_id=None, lease=WORKER_LEASE):
+        self.node_id = node_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.lease_ms = int(lease * 1000)
+        self.token = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._alive_until = None
+
+    @property
+    def is_leader(self):
+        return self.token is not None
+
+    @property
+    def _value(self):
+        return f"{self.node_id}:{self.token}"
+
+    def acquire(self):
+        """True se questo worker è (o è appena diventato) leader."""
+        if self.token is not None and self.renew():
+            return True
+
+        token = _ACQUIRE(keys=[_LEASE_KEY, _TOKEN_KEY], args=[self.node_id, self.lease_ms])
+        self.token = int(token) if token else None
+        return self.token is not None
+
+    def renew(self):
+        """Prolunga il lease; False (e non più leader) se è stato perso."""
+        if self.token is None:
+            return False
+        if _RENEW(keys=[_LEASE_KEY], args=[self._value, self.lease_ms]):
+            return True
+        logging.warning(f"Lease di leadership perso (token {self.token}).")
+        self.token = None
+        return False
+
+    def alive(self, within):
+        """
+        Il main loop sta avanzando: il rinnovo in background prosegue per
+        altri `within` secondi. Se il loop si blocca il lease scade e lo
+        standby subentra.
+        """
+        self._alive_until = time.monotonic() + within
+
+    def ensure(self):
+        """Rinnova il lease o solleva LostLeadership."""
+        if not self.renew():
+            raise LostLeadership()
+
+    def release(self):
+        """Rilascia il lease (arresto pulito): lo standby subentra subito."""
+        self._stop.set()
+        if self.token is not None:
+            _RELEASE(keys=[_LEASE_KEY], args=[self._value])
+            self.token = None
+
+    # --------------------------------------------------
+    # Fencing delle scritture (pipeline WATCH/MULTI)
+    # --------------------------------------------------
+    def watch(self, pipe):
+        """WATCH sul token: i comandi seguenti sono immediati fino a multi()."""
+        pipe.watch(_TOKEN_KEY)
+        current = pipe.get(_TOKEN_KEY)
+        if self.token is None or int(current or 0) != self.token:
+            pipe.reset()
+            self.token = None
+            raise LostLeadership()
+
+    def execute(self, pipe):
+        """EXEC della pipeline fenced: LostLeadership se il token è cambiato."""
+        try:
+            return pipe.execute()
+        except redis.WatchError:
+            self.token = None
+            raise LostLeadership()
+
+    # --------------------------------------------------
+    # Rinnovo in background
+    # --------------------------------------------------
+    def start_renewal(self):
+        def run():
+            stalled = False
+            while not self._stop.wait(self.lease_ms / 3000):
+                if self._alive_until is not None and time.monotonic() > self._alive_until:
+                    if not stalled and self.token is not None:
+                        logging.warning("Main loop fermo: lease non rinnovato, lascio subentrare lo standby.")
+                    stalled = True
+                    continue
+                stalled = False
+                try:
+                    self.renew()
+                except redis.RedisError as e:
+                    logging.warning(f"Rinnovo lease fallito: {e}")
+
+        self._thread = threading.Thread(target=run, name="leader-lease", daemon=True)
+        self._thread.start()
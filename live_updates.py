@@ -0,0 +1,68 @@
+# live_updates.py
+
+import json
+import queue
+import threading
+import time
+
+from redis_history import subscribe_snapshots
+
+# Eventi in coda per stream: oltre questo il client è troppo lento
+# e riceve un "resync" al posto dei change-set persi
+_CLIENT_QUEUE_SIZE = 20
+
+_RESYNC = json.dumps({"resync": True})
+
+
+class SnapshotBroadcaster:
+    """
+    Un solo subscriber Redis per processo: i change-set pubblicati dal worker
+    vengono distribuiti a tutti gli stream SSE aperti su questo processo.
+    """
+
+    def __init__(self):
+        self._clients = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def subscribe(self):
+        q = queue.Queue(maxsize=_CLIENT_QUEUE_SIZE)
+        with self._lock:
+            self._clients.add(q)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="snapshot-pubsub", daemon=True)
+                self._thread.start()
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._clients.discard(q)
+
+    def _broadcast(self, data):
+        with self._lock:
+            clients = list(self._clients)
+
+        for q in clients:
+            try:
+                q.put_nowait(data)
+            except queue.Full:
+                # Client lento → svuota la coda e chiede un resync completo
+                with q.mutex:
+                    q.queue.clear()
+                q.put_nowait(_RESYNC)
+
+    def _run(self):
+        while True:
+            try:
+                pubsub = subscribe_snapshots()
+                # Dopo una riconnessione qualche evento può essere perso
+                self._broadcast(_RESYNC)
+                for msg in pubsub.listen():
+                    if msg.get("type") == "message":
+                        self._broadcast(msg["data"])
+            except Exception as e:
+                print(f"⚠ Subscriber snapshot interrotto: {e}")
+                time.sleep(2)
+
+
+broadcaster = SnapshotBroadcaster()
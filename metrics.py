@@ -0,0 +1,197 @@
+# metrics.py
+
+import os
+import time
+
+from prometheus_client import (
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    CONTENT_TYPE_LATEST,
+    generate_latest,
+    multiprocess,
+    start_http_server,
+)
+from prometheus_client.core import GaugeMetricFamily
+
+from config import METRICS_BIND_ADDR
+
+# ------------------ METRICHE PROMETHEUS ------------------ #
+#
+# Un solo registro per processo: la web app le espone su /metrics, worker e
+# dispatcher su una porta dedicata (METRICS_*_PORT in config). Con
+# PROMETHEUS_MULTIPROC_DIR (web app sotto gunicorn con più worker) /metrics
+# aggrega i file scritti da tutti i processi.
+
+# Richieste di rete: da pochi ms fino ai timeout delle sorgenti
+_NETWORK_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 15, 30)
+
+# Operazioni Redis: normalmente sotto il millisecondo
+_REDIS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+
+
+# ------------------------------------------------------
+# Sorgenti (istanze Kuma, status server)
+# ------------------------------------------------------
+UPSTREAM_FETCH = Histogram(
+    "kuma_dashboard_upstream_fetch_seconds",
+    "Durata delle richieste alle sorgenti (host Kuma o status)",
+    ["source"],
+    buckets=_NETWORK_BUCKETS,
+)
+UPSTREAM_ERRORS = Counter(
+    "kuma_dashboard_upstream_errors_total",
+    "Richieste alle sorgenti fallite",
+    ["source"],
+)
+
+# ------------------------------------------------------
+# Redis
+# ------------------------------------------------------
+REDIS_OP = Histogram(
+    "kuma_dashboard_redis_op_seconds",
+    "Durata delle operazioni Redis per funzione",
+    ["op"],
+    buckets=_REDIS_BUCKETS,
+)
+
+# ------------------------------------------------------
+# Web app
+# ------------------------------------------------------
+BUILD_DASHBOARD = Histogram(
+    "kuma_dashboard_build_seconds",
+    "Costruzione dei dati della dashboard dalle sorgenti",
+    buckets=_NETWORK_BUCKETS,
+)
+RENDER = Histogram(
+    "kuma_dashboard_render_seconds",
+    "Tempo di risposta delle viste della dashboard",
+    ["view"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+
+# ------------------------------------------------------
+# History worker
+# ------------------------------------------------------
+WORKER_CYCLE = Histogram(
+    "kuma_dashboard_worker_cycle_seconds",
+    "Durata di un ciclo del worker",
+    buckets=_NETWORK_BUCKETS,
+)
+WORKER_LAG = Histogram(
+    "kuma_dashboard_worker_schedule_lag_seconds",
+    "Ritardo della partenza del ciclo rispetto al tick previsto",
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30),
+)
+WORKER_SKIPPED_TICKS = Counter(
+    "kuma_dashboard_worker_skipped_ticks_total",
+    "Tick saltati perché il ciclo precedente ha superato il periodo",
+)
+WORKER_LEADER = Gauge(
+    "kuma_dashboard_worker_leader",
+    "1 se questo worker detiene il lease di leadership",
+)
+WORKER_ERRORS = Counter(
+    "kuma_dashboard_worker_errors_total",
+    "Cicli del worker terminati con errore",
+)
+MONITORS = Gauge(
+    "kuma_dashboard_monitors",
+    "Monitor presenti su tutte le istanze Kuma",
+)
+SOURCE_MONITORS = Gauge(
+    "kuma_dashboard_source_monitors",
+    "Monitor caricati da ogni status page Kuma",
+    ["source"],
+)
+SOURCE_MISSING = Gauge(
+    "kuma_dashboard_source_missing_monitors",
+    "Monitor assenti in un gruppo di sorgenti ma presenti in altri",
+    ["group"],
+)
+MONITORS_BY_SEVERITY = Gauge(
+    "kuma_dashboard_monitors_by_severity",
+    "Monitor per severità (up, mismatch, down)",
+    ["severity"],
+)
+
+# ------------------------------------------------------
+# Notifiche push
+# ------------------------------------------------------
+PUSH_LATENCY = Histogram(
+    "kuma_dashboard_push_delivery_seconds",
+    "Durata della consegna di una push per provider",
+    ["provider"],
+    buckets=_NETWORK_BUCKETS,
+)
+PUSH_FAILURES = Counter(
+    "kuma_dashboard_push_failures_total",
+    "Push non consegnate per provider",
+    ["provider"],
+)
+
+
+_SEVERITY_LABELS = ("up", "mismatch", "down")
+
+
+def observe_rows(rows):
+    """Aggiorna i gauge dei monitor a partire dalle righe della dashboard."""
+    counts = [0, 0, 0]
+    for row in rows:
+        counts[row["severity"]] += 1
+
+    MONITORS.set(len(rows))
+    for label, count in zip(_SEVERITY_LABELS, counts):
+        MONITORS_BY_SEVERITY.labels(label).set(count)
+
+
+def observe_sources(join, missing):
+    """Aggiorna i gauge delle sorgenti Kuma dal MonitorJoin del ciclo."""
+    for page_id, count in join.contributed.items():
+        SOURCE_MONITORS.labels(page_id).set(count)
+    for group in join.groups:
+        SOURCE_MISSING.labels(group).set(len(missing.get(group, ())))
+
+
+def serve_metrics(port, addr=METRICS_BIND_ADDR):
+    """Espone le metriche del processo su http://{addr}:{port}/metrics."""
+    if port:
+        start_http_server(port, addr=addr)
+
+
+# Metriche calcolate a ogni scrape, fuori dai registri per processo: in
+# modalità multiprocess un gauge impostato da un worker resterebbe vecchio
+_SCRAPE_REGISTRY = CollectorRegistry(auto_describe=True)
+
+
+class SnapshotAgeCollector:
+    """Età dello snapshot dal timestamp di pubblicazione (+Inf se assente)."""
+
+    def __init__(self, published):
+        self.published = published
+
+    def collect(self):
+        ts = self.published()
+        age = float("inf") if ts is None else max(0.0, time.time() - ts)
+        yield GaugeMetricFamily(
+            "kuma_dashboard_snapshot_age_seconds",
+            "Età dello snapshot pubblicato dal worker (+Inf se assente)",
+            value=age,
+        )
+
+
+def register_scrape_collector(collector):
+    _SCRAPE_REGISTRY.register(collector)
+
+
+def metrics_payload():
+    """Ritorna (body, content_type) per l'endpoint /metrics della web app."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    body = generate_latest(registry) + generate_latest(_SCRAPE_REGISTRY)
+    return body, CONTENT_TYPE_LATEST
@@ -0,0 +1,61 @@
+# probes.py
+
+from config import PROBES
+
+# ------------------ STATO SONDE E SEVERITÀ ------------------ #
+#
+# Lo stato delle sonde di un monitor è una bitmask: il bit i è acceso se la
+# sonda PROBES[i] vede il monitor DOWN. Severità e stato finale dipendono
+# solo dalla maschera: 0 = tutte UP, 2 = tutte DOWN (stato finale DOWN),
+# 1 = sonde in disaccordo.
+
+# Colonne delle righe → sonda
+PROBE_COLUMNS = {key: probe for key, probe, _ in PROBES}
+
+_PROBE_BITS = {probe: 1 << i for i, (_, probe, _) in enumerate(PROBES)}
+_COLUMN_BITS = [(key, 1 << i) for i, (key, _, _) in enumerate(PROBES)]
+
+ALL_DOWN = (1 << len(PROBES)) - 1
+
+
+def _severity(mask):
+    if mask == 0:
+        return 0
+    if mask == ALL_DOWN:
+        return 2
+    return 1
+
+
+# Fino a 8 sonde le maschere stanno in un byte: la severità di tutto il batch
+# è un solo bytes.translate con la tabella maschera → severità
+_SEVERITY_TABLE = (
+    bytes(_severity(m) if m <= ALL_DOWN else 0 for m in range(256))
+    if len(PROBES) <= 8
+    else None
+)
+
+
+def probe_mask(entry):
+    """Maschera delle sonde DOWN per una entry dello status (None → 0)."""
+    mask = 0
+    if entry:
+        for probe in entry.get("probes", ()):
+            mask |= _PROBE_BITS.get(probe, 0)
+    return mask
+
+
+def evaluate(masks):
+    """Severità di tutti i monitor, nello stesso ordine delle maschere."""
+    if _SEVERITY_TABLE is not None:
+        return list(bytes(masks).translate(_SEVERITY_TABLE))
+    return [_severity(m) for m in masks]
+
+
+def probe_columns(mask):
+    """{ chiave colonna : "UP"/"DOWN" } per la riga della dashboard."""
+    return {key: "DOWN" if mask & bit else "UP" for key, bit in _COLUMN_BITS}
+
+
+def probe_headers():
+    """Chiavi ed etichette delle colonne sonda, per template e JS."""
+    return [{"key": key, "label": label} for key, _, label in PROBES]
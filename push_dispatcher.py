@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+
+import time
+import logging
+
+from config import PUSH_DISPATCH_POLL, METRICS_DISPATCHER_PORT
+from metrics import serve_metrics
+from push_queue import dispatch_due, seconds_to_next, wait_for_work
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="[%(asctime)s] %(levelname)s - %(message)s"
+)
+
+
+# ------------------------------------------------------
+# MAIN LOOP – consegna delle notifiche in coda
+# ------------------------------------------------------
+def main_loop():
+    logging.info("=== Push dispatcher avviato ===")
+    serve_metrics(METRICS_DISPATCHER_PORT)
+
+    while True:
+        try:
+            dispatch_due()
+
+            next_due = seconds_to_next()
+            timeout = PUSH_DISPATCH_POLL if next_due is None else min(next_due, PUSH_DISPATCH_POLL)
+            wait_for_work(timeout)
+        except Exception as e:
+            logging.exception(f"Errore dispatcher: {e}")
+            time.sleep(PUSH_DISPATCH_POLL)
+
+
+if __name__ == "__main__":
+    main_loop()
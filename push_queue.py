@@ -0,0 +1,217 @@
+# push_queue.py
+
+import json
+import logging
+import time
+import uuid
+
+from config import (
+    PUSH_COALESCE_WINDOW,
+    PUSH_QUEUE_TTL,
+    PUSH_MAX_RETRIES,
+    PUSH_RETRY_BASE,
+    PUSH_INFLIGHT_TIMEOUT,
+)
+from redis_history import r
+from push_utils import send_push_to_all
+
+# ------------------ CODA NOTIFICHE ------------------ #
+#
+# push:queue:msg       hash  { id : messaggio JSON }
+# push:queue:due       zset  { id : istante di consegna }
+# push:queue:inflight  zset  { id : scadenza della presa in carico }
+# push:queue:coalesce  hash  { chiave : id in attesa } → eventi accorpati
+# push:queue:wakeup    lista usata solo per svegliare il dispatcher
+# push:queue:last:{chiave}  ultimo stato notificato per la chiave
+#
+# Il worker accoda e prosegue; push_dispatcher.py consegna, ritenta con
+# backoff esponenziale e scarta i messaggi scaduti. Un messaggio preso in
+# carico resta in push:queue:inflight finché deliver() non termina: se il
+# dispatcher muore o la consegna fallisce con un'eccezione, dopo
+# PUSH_INFLIGHT_TIMEOUT torna in coda (consegna almeno una volta).
+
+_MSG_KEY = "push:queue:msg"
+_DUE_KEY = "push:queue:due"
+_INFLIGHT_KEY = "push:queue:inflight"
+_COALESCE_KEY = "push:queue:coalesce"
+_WAKEUP_KEY = "push:queue:wakeup"
+_LAST_STATE_PREFIX = "push:queue:last:"
+
+# Un messaggio con chiave già in attesa ne sostituisce il contenuto
+# mantenendo l'istante di consegna: N eventi → una sola notifica
+_ENQUEUE = r.register_script("""
+local id = ARGV[1]
+if ARGV[4] ~= '' then
+    local pending = redis.call('HGET', KEYS[3], ARGV[4])
+    if pending and redis.call('ZSCORE', KEYS[2], pending) then
+        redis.call('HSET', KEYS[1], pending, ARGV[2])
+        return pending
+    end
+    redis.call('HSET', KEYS[3], ARGV[4], id)
+end
+redis.call('HSET', KEYS[1], id, ARGV[2])
+redis.call('ZADD', KEYS[2], ARGV[3], id)
+redis.call('LPUSH', KEYS[4], 1)
+redis.call('LTRIM', KEYS[4], 0, 0)
+return id
+""")
+
+# Presa in carico atomica: un messaggio va a un solo dispatcher e passa
+# tra quelli in consegna fino alla conferma (o alla scadenza ARGV[2])
+_CLAIM = r.register_script("""
+if redis.call('ZREM', KEYS[1], ARGV[1]) == 0 then
+    return false
+end
+local msg = redis.call('HGET', KEYS[2], ARGV[1])
+if not msg then
+    return false
+end
+redis.call('ZADD', KEYS[4], ARGV[2], ARGV[1])
+local ok, decoded = pcall(cjson.decode, msg)
+if ok and type(decoded['coalesce_key']) == 'string' then
+    if redis.call('HGET', KEYS[3], decoded['coalesce_key']) == ARGV[1] then
+        redis.call('HDEL', KEYS[3], decoded['coalesce_key'])
+    end
+end
+return msg
+""")
+
+# Consegne non confermate entro la scadenza → di nuovo in coda
+_REQUEUE = r.register_script("""
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+for _, id in ipairs(expired) do
+    redis.call('ZREM', KEYS[1], id)
+    redis.call('ZADD', KEYS[2], ARGV[1], id)
+end
+return #expired
+""")
+
+
+def enqueue_push(title, body, data=None, coalesce_key=None, state=None, delay=None):
+    """
+    Accoda una notifica per push_dispatcher.py e ritorna subito.
+
+    coalesce_key: gli eventi con la stessa chiave entro PUSH_COALESCE_WINDOW
+    secondi diventano un'unica notifica con il contenuto più recente.
+    state: stato rappresentato (es. "RED"); se al momento della consegna è
+    uguale all'ultimo notificato per la chiave, la notifica viene scartata.
+    """
+    now = time.time()
+    if delay is None:
+        delay = PUSH_COALESCE_WINDOW if coalesce_key else 0
+
+    message = {
+        "title": title,
+        "body": body,
+        "data": data or {},
+        "coalesce_key": coalesce_key,
+        "state": state,
+        "created": now,
+        "expires_at": now + PUSH_QUEUE_TTL,
+        "attempts": 0,
+        "endpoints": None,
+    }
+    return _ENQUEUE(
+        keys=[_MSG_KEY, _DUE_KEY, _COALESCE_KEY, _WAKEUP_KEY],
+        args=[uuid.uuid4().hex, json.dumps(message), now + delay, coalesce_key or ""],
+    )
+
+
+def _reschedule(message, endpoints):
+    """Ritenta solo gli endpoint falliti con backoff esponenziale."""
+    message["attempts"] += 1
+    if message["attempts"] > PUSH_MAX_RETRIES:
+        logging.warning(f"Notifica '{message['title']}' scartata dopo {PUSH_MAX_RETRIES} tentativi.")
+        return
+
+    delay = PUSH_RETRY_BASE * 2 ** (message["attempts"] - 1)
+    message["endpoints"] = endpoints
+    # I ritentativi non si accorpano: riguardano un contenuto già deciso
+    message["coalesce_key"] = None
+
+    msg_id = uuid.uuid4().hex
+    pipe = r.pipeline()
+    pipe.hset(_MSG_KEY, msg_id, json.dumps(message))
+    pipe.zadd(_DUE_KEY, {msg_id: time.time() + delay})
+    pipe.execute()
+    logging.info(f"Notifica '{message['title']}': ritento {len(endpoints)} endpoint tra {delay}s.")
+
+
+def deliver(message):
+    """Consegna un messaggio della coda. Ritorna l'esito per endpoint."""
+    key, state = message.get("coalesce_key"), message.get("state")
+    last_key = f"{_LAST_STATE_PREFIX}{key}"
+
+    if key and state is not None and r.get(last_key) == state:
+        logging.info(f"Notifica '{message['title']}' superata: stato {state} già notificato.")
+        return []
+
+    results = send_push_to_all(
+        message["title"], message["body"], message.get("data"), endpoints=message.get("endpoints")
+    )
+
+    failed = [res["endpoint"] for res in results if not res["ok"] and not res["dead"]]
+    if key and state is not None and (not results or len(failed) < len(results)):
+        r.set(last_key, state)
+    if failed:
+        _reschedule(message, failed)
+
+    return results
+
+
+def _ack(msg_id):
+    """Conferma un messaggio gestito: esce dalla coda definitivamente."""
+    pipe = r.pipeline()
+    pipe.zrem(_INFLIGHT_KEY, msg_id)
+    pipe.hdel(_MSG_KEY, msg_id)
+    pipe.execute()
+
+
+def dispatch_due(limit=100):
+    """
+    Consegna i messaggi arrivati a scadenza. Ritorna quanti ne ha gestiti.
+    """
+    now = time.time()
+    handled = 0
+
+    requeued = _REQUEUE(keys=[_INFLIGHT_KEY, _DUE_KEY], args=[now])
+    if requeued:
+        logging.warning(f"{requeued} notifiche non confermate rimesse in coda.")
+
+    for msg_id in r.zrangebyscore(_DUE_KEY, "-inf", now, start=0, num=limit):
+        raw = _CLAIM(
+            keys=[_DUE_KEY, _MSG_KEY, _COALESCE_KEY, _INFLIGHT_KEY],
+            args=[msg_id, now + PUSH_INFLIGHT_TIMEOUT],
+        )
+        if not raw:
+            continue
+        handled += 1
+
+        message = json.loads(raw)
+        if message["expires_at"] < now:
+            logging.warning(f"Notifica '{message['title']}' scaduta, non inviata.")
+            _ack(msg_id)
+            continue
+
+        try:
+            deliver(message)
+        except Exception as e:
+            # Resta in consegna: torna in coda alla scadenza della presa in carico
+            logging.exception(f"Consegna di '{message['title']}' fallita: {e}")
+            continue
+        _ack(msg_id)
+
+    return handled
+
+
+def seconds_to_next():
+    """Secondi al prossimo messaggio in scadenza (None se la coda è vuota)."""
+    first = r.zrange(_DUE_KEY, 0, 0, withscores=True)
+    if not first:
+        return None
+    return max(0.0, first[0][1] - time.time())
+
+
+def wait_for_work(timeout):
+    """Attende un nuovo messaggio in coda o lo scadere di `timeout` secondi."""
+    r.blpop(_WAKEUP_KEY, timeout=max(0.1, timeout))
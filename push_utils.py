@@ -1,37 +1,80 @@
+import hashlib
 import json
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any
+from urllib.parse import urlparse
 
+import requests
+from py_vapid import Vapid
 from pywebpush import webpush, WebPushException
 
+from redis_history import r
+from metrics import PUSH_LATENCY, PUSH_FAILURES
 from config import (
     PUSH_ENABLED,
     PUSH_VAPID_PRIVATE_KEY,
     PUSH_VAPID_CLAIMS,
+    PUSH_CONCURRENCY,
+    PUSH_TIMEOUT,
 )
 
-SUBS_FILE = "push_subscriptions.json"
-
-
 # ----------------------------------------------------------------------
-#  CARICA / SALVA SUBSCRIPTIONS (file JSON)
+#  SUBSCRIPTIONS su Redis: hash { sha256(endpoint) : subscription JSON }
+#  Aggiunta e rimozione O(1) e atomiche, condivise tra tutti i processi
 # ----------------------------------------------------------------------
 
-def load_subscriptions() -> List[Dict[str, Any]]:
-    """Carica le subscription dal file JSON."""
-    if not os.path.exists(SUBS_FILE):
-        return []
-    try:
-        with open(SUBS_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except:
-        return []
+SUBS_KEY = "push:subscriptions"
+_SUBS_MIGRATED_KEY = "push:subscriptions:migrated"
+
+# Vecchio archivio JSON, importato una sola volta
+SUBS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "push_subscriptions.json")
+
+_migrated = False
+
+
+def _endpoint_id(endpoint: str) -> str:
+    return hashlib.sha256(endpoint.encode("utf-8")).hexdigest()
+
+
+def migrate_subscriptions_file() -> int:
+    """
+    Importa in Redis le subscription di push_subscriptions.json.
+    Idempotente (HSETNX): eseguita una volta, poi segnata in Redis.
+    Ritorna il numero di subscription importate.
+    """
+    global _migrated
+    if _migrated or r.exists(_SUBS_MIGRATED_KEY):
+        _migrated = True
+        return 0
+
+    subs = []
+    if os.path.exists(SUBS_FILE):
+        try:
+            with open(SUBS_FILE, "r", encoding="utf-8") as f:
+                subs = json.load(f)
+        except:
+            subs = []
+
+    pipe = r.pipeline()
+    for sub in subs:
+        if sub.get("endpoint"):
+            pipe.hsetnx(SUBS_KEY, _endpoint_id(sub["endpoint"]), json.dumps(sub))
+    pipe.set(_SUBS_MIGRATED_KEY, int(time.time()))
+    imported = sum(pipe.execute()[:-1])
+
+    if imported:
+        print(f"📦 Importate {imported} subscription da {SUBS_FILE}")
+    _migrated = True
+    return imported
 
 
-def save_subscriptions(subs: List[Dict[str, Any]]) -> None:
-    """Salva le subscription nel file JSON."""
-    with open(SUBS_FILE, "w", encoding="utf-8") as f:
-        json.dump(subs, f)
+def load_subscriptions() -> List[Dict[str, Any]]:
+    """Carica tutte le subscription."""
+    migrate_subscriptions_file()
+    return [json.loads(v) for v in r.hvals(SUBS_KEY)]
 
 
 # ----------------------------------------------------------------------
@@ -49,22 +92,26 @@ def add_subscription(sub: Dict[str, Any]) -> None:
         print("❌ Subscription ignorata (endpoint mancante)")
         return
 
-    subs = load_subscriptions()
-    endpoints = {s.get("endpoint") for s in subs}
-
-    if sub["endpoint"] in endpoints:
+    migrate_subscriptions_file()
+    if not r.hsetnx(SUBS_KEY, _endpoint_id(sub["endpoint"]), json.dumps(sub)):
         print(f"ℹ Subscription già presente: {sub['endpoint'][:50]}")
         return
 
     print(f"➕ Aggiunta subscription: {sub['endpoint'][:50]}...")
-    subs.append(sub)
-    save_subscriptions(subs)
 
 
-def remove_subscription(endpoint: str) -> None:
-    subs = load_subscriptions()
-    new_subs = [s for s in subs if s.get("endpoint") != endpoint]
-    save_subscriptions(new_subs)
+def remove_subscription(endpoint: str) -> bool:
+    """Rimuove la subscription dell'endpoint. Ritorna True se esisteva."""
+    return remove_subscriptions([endpoint]) > 0
+
+
+def remove_subscriptions(endpoints: List[str]) -> int:
+    """Rimuove più subscription con un solo HDEL atomico."""
+    ids = [_endpoint_id(e) for e in endpoints if e]
+    if not ids:
+        return 0
+    migrate_subscriptions_file()
+    return r.hdel(SUBS_KEY, *ids)
 
 
 # ----------------------------------------------------------------------
@@ -89,6 +136,47 @@ def _build_vapid_claims(endpoint: str) -> Dict[str, Any]:
     return claims
 
 
+# ----------------------------------------------------------------------
+#  HEADER VAPID firmati, in cache per audience
+# ----------------------------------------------------------------------
+
+# Durata del JWT VAPID (come pywebpush) e margine di rinnovo
+_VAPID_LIFETIME = 12 * 3600
+_VAPID_RENEW_MARGIN = 3600
+
+_vapid_key = None
+_vapid_cache: Dict[str, tuple] = {}
+_vapid_lock = threading.Lock()
+
+
+def _vapid_headers(endpoint: str) -> Dict[str, str]:
+    """
+    Header Authorization VAPID per l'endpoint. La firma dipende solo
+    dall'audience (origine del push service): viene calcolata una volta e
+    riusata finché il JWT resta valido.
+    """
+    global _vapid_key
+
+    claims = _build_vapid_claims(endpoint)
+    url = urlparse(endpoint)
+    claims.setdefault("aud", f"{url.scheme}://{url.netloc}")
+    audience = claims["aud"]
+
+    now = time.time()
+    with _vapid_lock:
+        cached = _vapid_cache.get(audience)
+        if cached and cached[1] > now:
+            return dict(cached[0])
+
+        if _vapid_key is None:
+            _vapid_key = Vapid.from_string(private_key=PUSH_VAPID_PRIVATE_KEY)
+
+        claims["exp"] = int(now) + _VAPID_LIFETIME
+        headers = _vapid_key.sign(claims)
+        _vapid_cache[audience] = (headers, claims["exp"] - _VAPID_RENEW_MARGIN)
+        return dict(headers)
+
+
 # ----------------------------------------------------------------------
 #  BUILD PAYLOAD cross-browser (Apple richiede "aps")
 # ----------------------------------------------------------------------
@@ -116,12 +204,85 @@ def _build_payload(title: str, body: str, data: Dict[str, Any]) -> str:
 
 
 # ----------------------------------------------------------------------
-#  INVIO PUSH
+#  INVIO PUSH (parallelo, concorrenza limitata)
 # ----------------------------------------------------------------------
 
-def send_push_to_all(title: str, body: str, data: Dict[str, Any] | None = None) -> None:
+_executor = ThreadPoolExecutor(max_workers=PUSH_CONCURRENCY, thread_name_prefix="push")
+
+# Sessione condivisa: keep-alive verso i push service
+_session = requests.Session()
+
+
+def push_provider(endpoint: str) -> str:
+    """Push service dell'endpoint: apple, fcm, mozilla, windows, other."""
+    host = urlparse(endpoint).netloc
+    if host.endswith("push.apple.com"):
+        return "apple"
+    if host.endswith("googleapis.com"):
+        return "fcm"
+    if host.endswith("mozilla.com"):
+        return "mozilla"
+    if host.endswith("notify.windows.com"):
+        return "windows"
+    return "other"
+
+
+def _send_one(sub: Dict[str, Any], payload: str) -> Dict[str, Any]:
+    """
+    Invia la push a una subscription con timeout dedicato.
+    Ritorna l'esito: endpoint, provider, ok, status, latency_ms, error, dead.
     """
-    Invia una push a TUTTE le subscription valide.
+    endpoint = sub.get("endpoint", "")
+    result = {
+        "endpoint": endpoint,
+        "provider": push_provider(endpoint),
+        "ok": False,
+        "status": None,
+        "latency_ms": None,
+        "error": None,
+        "dead": False,
+    }
+
+    start = time.monotonic()
+    try:
+        response = webpush(
+            subscription_info=sub,
+            data=payload,
+            headers=_vapid_headers(endpoint),
+            timeout=PUSH_TIMEOUT,
+            requests_session=_session,
+        )
+        result["ok"] = True
+        result["status"] = getattr(response, "status_code", None)
+
+    except WebPushException as e:
+        status = getattr(e.response, "status_code", None)
+        result["status"] = status
+        result["error"] = str(e).splitlines()[0]
+        # subscription non valida → rimuovere
+        result["dead"] = status in (404, 410)
+
+    except Exception as e:
+        result["error"] = str(e)
+
+    elapsed = time.monotonic() - start
+    result["latency_ms"] = round(elapsed * 1000, 1)
+
+    PUSH_LATENCY.labels(result["provider"]).observe(elapsed)
+    if not result["ok"]:
+        PUSH_FAILURES.labels(result["provider"]).inc()
+    return result
+
+
+def send_push_to_all(
+    title: str,
+    body: str,
+    data: Dict[str, Any] | None = None,
+    endpoints: List[str] | None = None,
+) -> List[Dict[str, Any]]:
+    """
+    Invia una push a TUTTE le subscription valide, in parallelo
+    (massimo PUSH_CONCURRENCY richieste insieme, PUSH_TIMEOUT ciascuna).
     Filtro:
     - Safari iOS
     - Chrome Desktop
@@ -130,19 +291,26 @@ def send_push_to_all(title: str, body: str, data: Dict[str, Any] | None = None)
     Gestisce:
     - rimozione subscription morte (404/410)
     - endpoint finti Edge Android
+    `endpoints` limita l'invio ad alcune subscription (ritentativi).
+    Ritorna l'esito per endpoint (provider, latenza, stato).
     """
     if not PUSH_ENABLED:
         print("🔕 PUSH disabilitate in config.py")
-        return
+        return []
 
     subs = load_subscriptions()
     if not subs:
         print("ℹ Nessuna subscription salvata.")
-        return
+        return []
+
+    if endpoints is not None:
+        wanted = set(endpoints)
+        subs = [s for s in subs if s.get("endpoint") in wanted]
 
     payload = _build_payload(title, body, data or {})
 
     dead: List[Dict[str, Any]] = []
+    targets: List[Dict[str, Any]] = []
 
     for sub in subs:
         endpoint = sub.get("endpoint", "")
@@ -155,32 +323,27 @@ def send_push_to_all(title: str, body: str, data: Dict[str, Any] | None = None)
             dead.append(sub)
             continue
 
-        vapid_claims = _build_vapid_claims(endpoint)
+        targets.append(sub)
 
-        print(f"📤 Invio push → {endpoint[:70]}...")
+    results = list(_executor.map(lambda sub: _send_one(sub, payload), targets))
 
-        try:
-            webpush(
-                subscription_info=sub,
-                data=payload,
-                vapid_private_key=PUSH_VAPID_PRIVATE_KEY,
-                vapid_claims=vapid_claims,
+    for sub, res in zip(targets, results):
+        if res["ok"]:
+            print(f"📤 {res['provider']} {res['endpoint'][:60]}... ✓ {res['latency_ms']} ms")
+        else:
+            print(
+                f"📤 {res['provider']} {res['endpoint'][:60]}... "
+                f"✗ {res['error']} (status={res['status']}, {res['latency_ms']} ms)"
             )
-            print("   ✓ OK")
-
-        except WebPushException as e:
-            status = getattr(e.response, "status_code", None)
-            print(f"   ✗ Errore WebPush: {e} (status={status})")
-
-            # subscription non valida → rimuovere
-            if status in (404, 410):
-                dead.append(sub)
+        if res["dead"]:
+            dead.append(sub)
 
-        except Exception as e:
-            print(f"   ✗ Errore generico: {e}")
+    ok = sum(1 for res in results if res["ok"])
+    print(f"📬 Push inviate: {ok}/{len(results)} OK")
 
-    # Pulizia subscription morte
+    # Pulizia subscription morte (solo quelle: le aggiunte concorrenti restano)
     if dead:
-        alive = [s for s in subs if s not in dead]
-        save_subscriptions(alive)
-        print(f"🧹 Rimosse {len(dead)} subscription invalide.")
\ No newline at end of file
+        removed = remove_subscriptions([s["endpoint"] for s in dead])
+        print(f"🧹 Rimosse {removed} subscription invalide.")
+
+    return results
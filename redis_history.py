@@ -1,7 +1,19 @@
 # redis_history.py
 
+import base64
+import json
+from datetime import datetime
+
 import redis
-from config import REDIS_HOST, REDIS_PORT, REDIS_DB, MAX_HISTORY_POINTS
+from config import (
+    REDIS_HOST,
+    REDIS_PORT,
+    REDIS_DB,
+    MAX_HISTORY_POINTS,
+    SNAPSHOT_MAX_AGE,
+    SNAPSHOT_DELTA_KEEP,
+)
+from metrics import REDIS_OP
 
 r = redis.Redis(
     host=REDIS_HOST,
@@ -10,25 +22,151 @@ r = redis.Redis(
     decode_responses=True
 )
 
+# ------------------ SCRITTURE DEL WORKER ------------------ #
+#
+# Con più worker in HA ogni scrittura riceve `fence` (il LeaderLease): la
+# pipeline fa WATCH sul token di fencing ed è in MULTI, così l'EXEC viene
+# scartato (LostLeadership) se nel frattempo un altro worker è diventato
+# leader. Senza `fence` è una pipeline normale.
+
+
+def write_pipeline(fence=None, transaction=True):
+    """Pipeline per le scritture, fenced se `fence` è dato."""
+    if fence is None:
+        return r.pipeline(transaction=transaction)
+    pipe = r.pipeline()
+    fence.watch(pipe)
+    pipe.multi()
+    return pipe
+
+
+def execute_writes(pipe, fence=None):
+    return pipe.execute() if fence is None else fence.execute(pipe)
+
+
 # ------------------ STORICO PER MONITOR ------------------ #
+#
+# Lo storico di ogni monitor è una sola stringa Redis `hist:{name_norm}`:
+# 2 byte con il numero di punti, poi 2 bit per punto (severità 0/1/2),
+# 4 punti per byte dal bit più alto, il tutto in base64. La stessa stringa
+# viene passata così com'è al browser, che la decodifica.
+
+_LEGACY_HISTORY_PREFIX = "history:"
+
+
+def _history_key(name_norm):
+    return f"hist:{name_norm}"
+
+
+def pack_history(points):
+    """
+    Codifica una lista di severità (0/1/2) nel formato compatto base64.
+    Mantiene solo gli ultimi MAX_HISTORY_POINTS punti.
+    """
+    points = list(points)[-MAX_HISTORY_POINTS:]
+    buf = bytearray(len(points).to_bytes(2, "big"))
+    buf.extend(bytes((len(points) + 3) // 4))
+    for i, sev in enumerate(points):
+        buf[2 + i // 4] |= (int(sev) & 3) << (6 - 2 * (i % 4))
+    return base64.b64encode(bytes(buf)).decode("ascii")
+
+
+def unpack_history(packed):
+    """
+    Decodifica lo storico compatto in una lista di severità.
+    """
+    if not packed:
+        return []
+    buf = base64.b64decode(packed)
+    count = int.from_bytes(buf[:2], "big")
+    return [(buf[2 + i // 4] >> (6 - 2 * (i % 4))) & 3 for i in range(count)]
+
 
 def save_point(name_norm, severity):
     """
     Salva un punto nello storico di un monitor, usando il nome normalizzato
     come chiave stabile. Mantiene massimo MAX_HISTORY_POINTS valori.
     """
-    key = f"history:{name_norm}"
-    r.rpush(key, severity)
-    r.ltrim(key, -MAX_HISTORY_POINTS, -1)
+    save_points({name_norm: severity})
 
 
 def load_history(name_norm):
     """
     Carica lo storico (0/1/2) dal Redis usando il nome normalizzato.
     """
-    key = f"history:{name_norm}"
-    data = r.lrange(key, 0, -1)
-    return [int(x) for x in data] if data else []
+    return unpack_history(r.get(_history_key(name_norm)))
+
+
+def _append_points(names, current, points):
+    return {
+        name_norm: pack_history(unpack_history(old) + [points[name_norm]])
+        for name_norm, old in zip(names, current)
+    }
+
+
+@REDIS_OP.labels("save_points").time()
+def save_points(points, fence=None):
+    """
+    Salva un punto per ogni monitor { name_norm : severità }: un MGET per
+    leggere gli storici compatti e un MSET (atomico) per riscriverli.
+    Ritorna { name_norm : storico compatto aggiornato }.
+
+    Solo il worker leader scrive lo storico: con `fence` (il LeaderLease)
+    lettura e scrittura stanno in un WATCH/MULTI sul token di fencing, e la
+    scrittura viene scartata se nel frattempo un altro worker è diventato
+    leader.
+    """
+    if not points:
+        return {}
+    names = list(points)
+    keys = [_history_key(n) for n in names]
+
+    if fence is None:
+        packed = _append_points(names, r.mget(keys), points)
+        r.mset({_history_key(n): value for n, value in packed.items()})
+        return packed
+
+    with r.pipeline() as pipe:
+        fence.watch(pipe)
+        packed = _append_points(names, pipe.mget(keys), points)
+        pipe.multi()
+        pipe.mset({_history_key(n): value for n, value in packed.items()})
+        fence.execute(pipe)
+    return packed
+
+
+@REDIS_OP.labels("load_histories").time()
+def load_histories(names):
+    """
+    Carica lo storico compatto di più monitor con un solo MGET.
+    Ritorna { name_norm : storico base64 } senza decodificarlo:
+    viene inoltrato tale e quale al client.
+    """
+    names = list(names)
+    if not names:
+        return {}
+    values = r.mget([_history_key(n) for n in names])
+    return {name_norm: value or "" for name_norm, value in zip(names, values)}
+
+
+def migrate_legacy_history():
+    """
+    Converte una tantum gli storici in formato lista (`history:{name}`,
+    un elemento per punto) nel formato compatto. Ritorna i monitor migrati.
+    """
+    migrated = 0
+    for key in r.scan_iter(match=f"{_LEGACY_HISTORY_PREFIX}*", count=500):
+        if r.type(key) != "list":
+            continue
+        name_norm = key[len(_LEGACY_HISTORY_PREFIX):]
+        points = [int(x) for x in r.lrange(key, 0, -1)]
+
+        pipe = r.pipeline()
+        pipe.set(_history_key(name_norm), pack_history(points))
+        pipe.delete(key)
+        pipe.execute()
+        migrated += 1
+    return migrated
 
 
 # ------------------ STATO GLOBALE PER PUSH ------------------ #
@@ -36,23 +174,168 @@ def load_history(name_norm):
 _GLOBAL_STATE_KEY = "global_state"
 
 
+@REDIS_OP.labels("get_global_state").time()
 def get_global_state():
     """
     Ritorna lo stato globale salvato in Redis: 'GREEN', 'YELLOW', 'RED' oppure None.
     """
-    val = r.get(_GLOBAL_STATE_KEY)
+    return _parse_global_state(r.get(_GLOBAL_STATE_KEY))
+
+
+def _parse_global_state(val):
     if not val:
         return None
     val = val.upper()
     return val if val in ("GREEN", "YELLOW", "RED") else None
 
 
-def set_global_state(state: str):
+@REDIS_OP.labels("swap_global_state").time()
+def swap_global_state(state: str, fence=None):
     """
-    Salva lo stato globale in Redis ('GREEN' / 'YELLOW' / 'RED').
-    Ignora valori non validi.
+    Salva lo stato globale ('GREEN' / 'YELLOW' / 'RED') e ritorna quello
+    precedente, in un solo GETSET atomico: con più processi ogni
+    transizione viene vista da un solo chiamante.
+    Valori non validi vengono ignorati (ritorna None).
     """
     state = (state or "").upper()
     if state not in ("GREEN", "YELLOW", "RED"):
-        return
-    r.set(_GLOBAL_STATE_KEY, state)
\ No newline at end of file
+        return None
+    pipe = write_pipeline(fence)
+    pipe.getset(_GLOBAL_STATE_KEY, state)
+    return _parse_global_state(execute_writes(pipe, fence)[0])
+
+# ------------------ SNAPSHOT DASHBOARD ------------------ #
+
+_SNAPSHOT_KEY = "dashboard:snapshot"
+_SNAPSHOT_VERSION_KEY = "dashboard:snapshot_version"
+_SNAPSHOT_CURRENT_KEY = "dashboard:snapshot_current"
+_SNAPSHOT_PUBLISHED_KEY = "dashboard:snapshot_published"
+_SNAPSHOT_CHANGES_KEY = "dashboard:changes"
+_SNAPSHOT_CHANNEL = "dashboard:events"
+
+
+@REDIS_OP.labels("publish_snapshot").time()
+def publish_snapshot(items, global_state, changes=None, fence=None):
+    """
+    Pubblica lo snapshot completo della dashboard (righe, stato globale,
+    timestamp) con una versione crescente. Ritorna la versione pubblicata.
+    Snapshot e versione corrente scadono insieme dopo SNAPSHOT_MAX_AGE.
+
+    `changes` è il change-set rispetto allo snapshot precedente
+    ({"from", "changed", "added", "removed"}); senza change-set la catena
+    delle richieste incrementali riparte da zero.
+    """
+    if fence is None:
+        version = r.incr(_SNAPSHOT_VERSION_KEY)
+        pipe = r.pipeline()
+    else:
+        # Versione letta sotto WATCH e scritta nella stessa transazione
+        pipe = r.pipeline()
+        fence.watch(pipe)
+        version = int(pipe.get(_SNAPSHOT_VERSION_KEY) or 0) + 1
+        pipe.multi()
+        pipe.set(_SNAPSHOT_VERSION_KEY, version)
+
+    now = datetime.now()
+    timestamp = now.isoformat()
+    snapshot = {
+        "version": version,
+        "items": items,
+        "global_state": global_state,
+        "timestamp": timestamp,
+        "history_max": MAX_HISTORY_POINTS,
+        "history_encoding": "2bit-base64",
+    }
+    pipe.set(_SNAPSHOT_KEY, json.dumps(snapshot), ex=SNAPSHOT_MAX_AGE)
+    pipe.set(_SNAPSHOT_CURRENT_KEY, version, ex=SNAPSHOT_MAX_AGE)
+    pipe.set(_SNAPSHOT_PUBLISHED_KEY, now.timestamp(), ex=SNAPSHOT_MAX_AGE)
+
+    if changes is not None:
+        changes = dict(changes, version=version, global_state=global_state, timestamp=timestamp)
+        event = json.dumps(changes)
+        pipe.rpush(_SNAPSHOT_CHANGES_KEY, event)
+        pipe.ltrim(_SNAPSHOT_CHANGES_KEY, -SNAPSHOT_DELTA_KEEP, -1)
+        pipe.expire(_SNAPSHOT_CHANGES_KEY, SNAPSHOT_MAX_AGE)
+    else:
+        # Senza "from" i client ricaricano lo snapshot completo
+        event = json.dumps({"version": version, "global_state": global_state, "timestamp": timestamp})
+        pipe.delete(_SNAPSHOT_CHANGES_KEY)
+
+    # Notifica live (SSE) a tutte le web app in ascolto
+    pipe.publish(_SNAPSHOT_CHANNEL, event)
+
+    execute_writes(pipe, fence)
+    return version
+
+
+@REDIS_OP.labels("load_changes_since").time()
+def load_changes_since(since):
+    """
+    Ritorna i change-set successivi alla versione `since`, in ordine e
+    concatenati senza buchi. None se la catena non parte da `since`
+    (client troppo indietro o catena interrotta).
+    """
+    chain = []
+    expected = since
+    for raw in r.lrange(_SNAPSHOT_CHANGES_KEY, 0, -1):
+        changes = json.loads(raw)
+        if changes["version"] <= since:
+            continue
+        if changes["from"] != expected:
+            return None
+        chain.append(changes)
+        expected = changes["version"]
+    return chain or None
+
+
+def subscribe_snapshots():
+    """
+    Ritorna un PubSub iscritto al canale dei nuovi snapshot: ogni messaggio
+    è il change-set JSON pubblicato dal worker.
+    """
+    pubsub = r.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(_SNAPSHOT_CHANNEL)
+    return pubsub
+
+
+@REDIS_OP.labels("get_snapshot_version").time()
+def get_snapshot_version():
+    """
+    Versione dello snapshot corrente (None se assente o scaduto).
+    Lettura leggera, senza trasferire il payload.
+    """
+    val = r.get(_SNAPSHOT_CURRENT_KEY)
+    return int(val) if val else None
+
+
+@REDIS_OP.labels("get_snapshot_published").time()
+def get_snapshot_published():
+    """
+    Epoch di pubblicazione dello snapshot corrente (None se assente o
+    scaduto), senza leggere lo snapshot.
+    """
+    val = r.get(_SNAPSHOT_PUBLISHED_KEY)
+    return float(val) if val else None
+
+
+@REDIS_OP.labels("load_snapshot_raw").time()
+def load_snapshot_raw():
+    """
+    Ritorna (versione, json) dello snapshot corrente letti insieme,
+    oppure (None, None).
+    """
+    version, raw = r.mget(_SNAPSHOT_CURRENT_KEY, _SNAPSHOT_KEY)
+    if not version or not raw:
+        return None, None
+    return int(version), raw
+
+
+def load_snapshot():
+    """
+    Ritorna l'ultimo snapshot pubblicato dal worker oppure None
+    (mai pubblicato o scaduto).
+    """
+    _, raw = load_snapshot_raw()
+    if not raw:
+        return None
+    return json.loads(raw)
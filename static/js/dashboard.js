@@ -15,7 +15,8 @@ function updateLogo() {
     if (!img) return;
 
     const isDark = document.body.classList.contains("dark");
-    img.src = isDark ? "/static/img/logoDark.png" : "/static/img/logoLight.png";
+    // URL versionati dal template (stessi del precache del service worker)
+    img.src = isDark ? img.dataset.dark : img.dataset.light;
 }
 
 function updateThemeIcons() {
@@ -132,7 +133,26 @@ function updateDownCountFromItems(items) {
 
 /************************************************************
  * RENDER TABELLA
+ * Riconciliazione per chiave (nome monitor): si aggiornano solo
+ * le righe cambiate, lo storico riceve solo le barre nuove e
+ * l'ordinamento sposta solo i nodi fuori posto.
  ************************************************************/
+// Colonne sonda (chiave, etichetta), definite dal template da config.PROBES
+const PROBES = DASHBOARD_PROBES;
+const CHECK_KEYS = PROBES.map(p => p.key);
+const SVG_NS = "http://www.w3.org/2000/svg";
+const BAR_STEP = 8;
+
+function rowState(item) {
+    if (item.final === "DOWN") return "down";
+    const states = new Set(CHECK_KEYS.map(k => item[k]));
+    return states.size > 1 ? "mismatch" : "up";
+}
+
+function itemSignature(item) {
+    return [item.name, item.link || "", item.final, ...CHECK_KEYS.map(k => item[k])].join("|");
+}
+
 function createStatusCell(status) {
     const td = document.createElement("td");
     td.classList.add(status === "DOWN" ? "status-down" : "status-up");
@@ -148,167 +168,402 @@ function createStatusCell(status) {
     return td;
 }
 
+function historyRect(sev, pos) {
+    const r = document.createElementNS(SVG_NS, "rect");
+    r.setAttribute("x", pos * BAR_STEP);
+    r.setAttribute("width", 6);
+    r.setAttribute("height", 20);
+    r.setAttribute("fill", sev === 2 ? "red" : sev === 1 ? "yellow" : "limegreen");
+    return r;
+}
+
+// Quanti punti nuovi ha `next` rispetto a `prev` (next = coda di prev + k punti)
+function appendedCount(prev, next) {
+    for (let k = 0; k <= next.length; k++) {
+        const keep = next.length - k;
+        if (keep > prev.length) continue;
+
+        let same = true;
+        for (let i = 0; i < keep; i++) {
+            if (next[i] !== prev[prev.length - keep + i]) {
+                same = false;
+                break;
+            }
+        }
+        if (same) return k;
+    }
+    return next.length;
+}
+
 function buildHistorySvg(history) {
-    const svg = document.createElementNS("http://www.w3.org/2000/svg", "svg");
+    const svg = document.createElementNS(SVG_NS, "svg");
     svg.setAttribute("width", "99%");
     svg.setAttribute("height", "20");
 
-    history.forEach((sev, idx) => {
-        const r = document.createElementNS("http://www.w3.org/2000/svg", "rect");
-        r.setAttribute("x", idx * 8);
-        r.setAttribute("width", 6);
-        r.setAttribute("height", 20);
+    // Le barre hanno posizione assoluta crescente; il gruppo scorre a sinistra
+    const g = document.createElementNS(SVG_NS, "g");
+    svg.appendChild(g);
+    svg._history = { g, points: [], base: 0 };
+
+    patchHistorySvg(svg, history);
+    return svg;
+}
+
+function patchHistorySvg(svg, history) {
+    const st = svg._history;
+    const prev = st.points;
+    const added = appendedCount(prev, history);
+    const drop = prev.length + added - history.length;
+
+    if (added === 0 && drop === 0) return;
 
-        r.setAttribute("fill", sev === 2 ? "red" : sev === 1 ? "yellow" : "limegreen");
-        svg.appendChild(r);
+    for (let i = 0; i < drop; i++) st.g.removeChild(st.g.firstChild);
+    st.base += drop;
+
+    for (let j = history.length - added; j < history.length; j++) {
+        st.g.appendChild(historyRect(history[j], st.base + j));
+    }
+    st.g.setAttribute("transform", `translate(${-st.base * BAR_STEP},0)`);
+    st.points = history.slice();
+}
+
+// Porta i figli di `parent` nell'ordine di `nodes` spostando solo quelli fuori posto
+function reorderChildren(parent, nodes) {
+    nodes.forEach((node, i) => {
+        const at = parent.children[i];
+        if (at !== node) parent.insertBefore(node, at || null);
     });
+}
 
-    return svg;
+const tableRows = new Map();
+
+function fillRowCells(tr, histTd, item) {
+    while (tr.firstChild && tr.firstChild !== histTd) tr.removeChild(tr.firstChild);
+
+    const tdName = document.createElement("td");
+    if (item.link) {
+        const a = document.createElement("a");
+        a.href = item.link;
+        a.textContent = item.name;
+        a.target = "_blank";
+        a.classList.add("text-decoration-none");
+        tdName.appendChild(a);
+    } else {
+        tdName.textContent = item.name;
+    }
+
+    tr.insertBefore(tdName, histTd);
+    CHECK_KEYS.forEach(k => tr.insertBefore(createStatusCell(item[k]), histTd));
+    tr.insertBefore(createStatusCell(item.final), histTd);
 }
 
 function renderTable(items) {
     const tbody = document.getElementById("main-tbody");
     if (!tbody) return;
 
-    tbody.innerHTML = "";
+    const seen = new Set();
+    const ordered = { down: [], mismatch: [], up: [] };
 
     items.forEach(item => {
-        const tr = document.createElement("tr");
-        const CHECK_KEYS = ["k1", "k2", "k3", "n1"];
-        const states = new Set(CHECK_KEYS.map(k => item[k]));
-
-        if (item.final === "DOWN") tr.classList.add("row-down");
-        else if (states.size > 1) tr.classList.add("row-mismatch");
-        else tr.classList.add("row-up");
-
-        const tdName = document.createElement("td");
-        if (item.link) {
-            const a = document.createElement("a");
-            a.href = item.link;
-            a.textContent = item.name;
-            a.target = "_blank";
-            a.classList.add("text-decoration-none");
-            tdName.appendChild(a);
+        const history = (item.history || []).slice(-50);
+        let entry = tableRows.get(item.name);
+
+        if (!entry) {
+            const tr = document.createElement("tr");
+            const histTd = document.createElement("td");
+            const svg = buildHistorySvg(history);
+            histTd.appendChild(svg);
+            tr.appendChild(histTd);
+
+            entry = { tr, histTd, svg, sig: null };
+            tableRows.set(item.name, entry);
         } else {
-            tdName.textContent = item.name;
+            patchHistorySvg(entry.svg, history);
         }
 
-        tr.appendChild(tdName);
-        tr.appendChild(createStatusCell(item.k1));
-        tr.appendChild(createStatusCell(item.k2));
-        tr.appendChild(createStatusCell(item.k3));
-        tr.appendChild(createStatusCell(item.n1));
-        tr.appendChild(createStatusCell(item.final));
+        const state = rowState(item);
+        const sig = itemSignature(item);
+        if (entry.sig !== sig) {
+            fillRowCells(entry.tr, entry.histTd, item);
+            entry.tr.className = "row-" + state;
+            entry.tr.style.display = onlyDownActive && state !== "down" ? "none" : "";
+            entry.sig = sig;
+        }
 
-        const hist = document.createElement("td");
-        hist.appendChild(buildHistorySvg((item.history || []).slice(-50)));
-        tr.appendChild(hist);
+        seen.add(item.name);
+        ordered[state].push(entry.tr);
+    });
 
-        tbody.appendChild(tr);
+    tableRows.forEach((entry, name) => {
+        if (seen.has(name)) return;
+        entry.tr.remove();
+        tableRows.delete(name);
     });
 
-    sortRowsBySeverity();
-    applyOnlyDownFilter();
+    // DOWN, poi mismatch, poi UP; stabile rispetto all'ordine del server
+    reorderChildren(tbody, [...ordered.down, ...ordered.mismatch, ...ordered.up]);
 }
 
-function sortRowsBySeverity() {
-    const tbody = document.getElementById("main-tbody");
-    if (!tbody) return;
+/************************************************************
+ * RENDER MOBILE
+ ************************************************************/
+const mobileCards = new Map();
+
+function fillCardFields(card, histLabel, item) {
+    while (card.firstChild && card.firstChild !== histLabel) card.removeChild(card.firstChild);
+
+    const title = document.createElement("div");
+    title.classList.add("mobile-title");
+    title.textContent = item.name;
+    card.insertBefore(title, histLabel);
 
-    const order = { "row-down": 0, "row-mismatch": 1, "row-up": 2 };
+    function add(label, status) {
+        const field = document.createElement("div");
+        field.classList.add("mobile-field");
+        field.textContent = label;
+        card.insertBefore(field, histLabel);
 
-    Array.from(tbody.querySelectorAll("tr"))
-        .sort((a, b) => {
-            const ac = a.classList.contains("row-down") ? "row-down" :
-                       a.classList.contains("row-mismatch") ? "row-mismatch" : "row-up";
-            const bc = b.classList.contains("row-down") ? "row-down" :
-                       b.classList.contains("row-mismatch") ? "row-mismatch" : "row-up";
-            return order[ac] - order[bc];
-        })
-        .forEach(r => tbody.appendChild(r));
+        const val = document.createElement("div");
+        val.classList.add("mobile-value");
+
+        const icon = document.createElement("i");
+        icon.classList.add("bi", "me-1");
+        icon.classList.add(status === "DOWN" ? "bi-x-circle-fill" : "bi-check-circle-fill");
+        icon.classList.add(status === "DOWN" ? "text-danger" : "text-success");
+
+        val.appendChild(icon);
+        val.appendChild(document.createTextNode(" " + status));
+        card.insertBefore(val, histLabel);
+    }
+
+    PROBES.forEach(p => add(p.label + ":", item[p.key]));
+    add("Finale:", item.final);
 }
 
-/************************************************************
- * RENDER MOBILE
- ************************************************************/
 function renderMobileCards(items) {
     const container = document.getElementById("mobile-list");
     if (!container) return;
 
-    container.innerHTML = "";
+    const seen = new Set();
+    const ordered = [];
 
     items.forEach(item => {
-        const card = document.createElement("div");
-        card.classList.add("mobile-card");
-
-        const CHECK_KEYS = ["k1", "k2", "k3", "n1"];
-        const states = new Set(CHECK_KEYS.map(k => item[k]));
-
-        if (item.final === "DOWN") card.classList.add("down");
-        else if (states.size > 1) card.classList.add("mismatch");
-        else card.classList.add("up");
-
-        const title = document.createElement("div");
-        title.classList.add("mobile-title");
-        title.textContent = item.name;
-        card.appendChild(title);
-
-        function add(label, status) {
-            const field = document.createElement("div");
-            field.classList.add("mobile-field");
-            field.textContent = label;
-            card.appendChild(field);
-
-            const val = document.createElement("div");
-            val.classList.add("mobile-value");
-
-            const icon = document.createElement("i");
-            icon.classList.add("bi", "me-1");
-            icon.classList.add(status === "DOWN" ? "bi-x-circle-fill" : "bi-check-circle-fill");
-            icon.classList.add(status === "DOWN" ? "text-danger" : "text-success");
-
-            val.appendChild(icon);
-            val.appendChild(document.createTextNode(" " + status));
-            card.appendChild(val);
+        const history = (item.history || []).slice(-40);
+        let entry = mobileCards.get(item.name);
+
+        if (!entry) {
+            const card = document.createElement("div");
+
+            const histLabel = document.createElement("div");
+            histLabel.classList.add("mobile-field", "mt-2");
+            histLabel.textContent = "Storico:";
+            card.appendChild(histLabel);
+
+            const svg = buildHistorySvg(history);
+            card.appendChild(svg);
+
+            entry = { card, histLabel, svg, sig: null };
+            mobileCards.set(item.name, entry);
+        } else {
+            patchHistorySvg(entry.svg, history);
         }
 
-        add("Aruba Bergamo:", item.k1);
-        add("TIM Sestu:", item.k2);
-        add("ILIAD Sinnai:", item.k3);
-        add("NodePing Europe:", item.n1);
-        add("Finale:", item.final);
+        const sig = itemSignature(item);
+        if (entry.sig !== sig) {
+            fillCardFields(entry.card, entry.histLabel, item);
+            entry.card.className = "mobile-card " + rowState(item);
+            entry.sig = sig;
+        }
 
-        const l = document.createElement("div");
-        l.classList.add("mobile-field", "mt-2");
-        l.textContent = "Storico:";
-        card.appendChild(l);
+        seen.add(item.name);
+        ordered.push(entry.card);
+    });
 
-        const limitedHistory = (item.history || []).slice(-40);
-        card.appendChild(buildHistorySvg(limitedHistory));
-        container.appendChild(card);
+    mobileCards.forEach((entry, name) => {
+        if (seen.has(name)) return;
+        entry.card.remove();
+        mobileCards.delete(name);
     });
+
+    reorderChildren(container, ordered);
+}
+
+/************************************************************
+ * AGGIORNAMENTI INCREMENTALI (?since=versione)
+ ************************************************************/
+let currentVersion = null;
+let currentItems = [];
+let historyMax = 60;
+
+function sortItems(items) {
+    // Stesso ordine del server: DOWN in cima, poi per nome
+    return items.sort((a, b) => {
+        const da = a.final === "DOWN" ? 0 : 1;
+        const db = b.final === "DOWN" ? 0 : 1;
+        if (da !== db) return da - db;
+        return a.name < b.name ? -1 : a.name > b.name ? 1 : 0;
+    });
+}
+
+// Storico compatto dal server: base64 con 2 byte di conteggio
+// e 2 bit per punto (4 punti per byte, dal bit più alto)
+function unpackHistory(packed) {
+    if (Array.isArray(packed)) return packed;
+    if (!packed) return [];
+
+    const bin = atob(packed);
+    const count = (bin.charCodeAt(0) << 8) | bin.charCodeAt(1);
+    const out = new Array(count);
+    for (let i = 0; i < count; i++) {
+        out[i] = (bin.charCodeAt(2 + (i >> 2)) >> (6 - 2 * (i & 3))) & 3;
+    }
+    return out;
+}
+
+function unpackItems(items) {
+    items.forEach(item => { item.history = unpackHistory(item.history); });
+    return items;
+}
+
+function applyDelta(data) {
+    const byName = new Map(currentItems.map(i => [i.name, i]));
+
+    (data.changes || []).forEach(c => {
+        (c.removed || []).forEach(name => byName.delete(name));
+
+        (c.changed || []).forEach(row => {
+            const old = byName.get(row.name);
+            byName.set(row.name, { ...row, history: old ? old.history : [] });
+        });
+
+        const added = new Set();
+        unpackItems(c.added || []).forEach(row => {
+            byName.set(row.name, row);
+            added.add(row.name);
+        });
+
+        // Ogni ciclo del worker aggiunge un punto (la severità) a ogni monitor
+        byName.forEach((item, name) => {
+            if (added.has(name)) return;
+            item.history = (item.history || []).concat([item.severity]).slice(-historyMax);
+        });
+    });
+
+    return sortItems(Array.from(byName.values()));
 }
 
 /************************************************************
  * AUTO REFRESH
  ************************************************************/
+let lastEtag = null;
+
+function applyPayload(data) {
+    // Delta calcolato da una versione non più mostrata (es. un evento SSE
+    // applicato mentre la richiesta era in volo): va scartato
+    if (data.mode === "delta" && data.since !== currentVersion) return false;
+
+    let items;
+    if (data.mode === "delta") {
+        items = applyDelta(data);
+    } else {
+        items = unpackItems(data.items || []);
+        historyMax = data.history_max || historyMax;
+    }
+    currentItems = items;
+    currentVersion = data.version || null;
+
+    renderTable(items);
+    renderMobileCards(items);
+    updateDownCountFromItems(items);
+    updateGlobalStatus(data.global_state || "GREEN");
+    updateMobileMenuStatus(data.global_state || "GREEN");
+    return true;
+}
+
 async function refreshDashboard() {
     try {
-        const res = await fetch("/api/dashboard-data", { cache: "no-store" });
+        // ETag gestito a mano: con "no-store" il browser non usa la sua cache
+        const headers = lastEtag ? { "If-None-Match": lastEtag } : {};
+        const url = currentVersion
+            ? "/api/dashboard-data?since=" + currentVersion
+            : "/api/dashboard-data";
+
+        const res = await fetch(url, { cache: "no-store", headers });
+        if (res.status === 304) return;
         if (!res.ok) return;
 
+        const etag = res.headers.get("ETag");
         const data = await res.json();
-        renderTable(data.items || []);
-        renderMobileCards(data.items || []);
-        updateDownCountFromItems(data.items || []);
-        updateGlobalStatus(data.global_state || "GREEN");
-        updateMobileMenuStatus(data.global_state || "GREEN");
+        if (applyPayload(data)) {
+            lastEtag = etag;
+        } else if (data.version > currentVersion) {
+            // Scartato ma più recente di quanto mostrato: si riparte da qui
+            refreshDashboard();
+        }
 
     } catch (e) {
         console.error("Errore auto-refresh:", e);
     }
 }
 
+/************************************************************
+ * STREAM LIVE (SSE) – il polling resta solo come riserva
+ ************************************************************/
+let streamAlive = false;
+
+function onStreamSnapshot(ev) {
+    let event;
+    try {
+        event = JSON.parse(ev.data);
+    } catch (e) {
+        return;
+    }
+
+    // Change-set consecutivo alla versione mostrata → applicato subito
+    if (event.from !== undefined && currentVersion !== null && event.from === currentVersion) {
+        applyPayload({
+            mode: "delta",
+            since: event.from,
+            version: event.version,
+            global_state: event.global_state,
+            changes: [event],
+        });
+        lastEtag = '"v' + event.version + '"';
+        return;
+    }
+
+    // Resync, snapshot completo o eventi persi → richiesta incrementale
+    refreshDashboard();
+}
+
+// Keepalive del server: snapshot diverso da quello mostrato o assente
+// (worker fermo, la API calcola i dati al volo) → si ricarica
+function onStreamHeartbeat(ev) {
+    let beat;
+    try {
+        beat = JSON.parse(ev.data);
+    } catch (e) {
+        return;
+    }
+    if (beat.version === null || beat.version !== currentVersion) refreshDashboard();
+}
+
+function startLiveStream() {
+    if (!("EventSource" in window)) return;
+
+    const es = new EventSource("/api/stream");
+    es.addEventListener("snapshot", onStreamSnapshot);
+    es.addEventListener("heartbeat", onStreamHeartbeat);
+    es.onopen = () => {
+        streamAlive = true;
+        refreshDashboard();
+    };
+    es.onerror = () => {
+        // EventSource si riconnette da solo; nel frattempo si torna al polling
+        streamAlive = false;
+    };
+}
+
 /************************************************************
  * PUSH DESKTOP (UNICA VERSIONE)
  ************************************************************/
@@ -402,5 +657,8 @@ document.addEventListener("DOMContentLoaded", () => {
     updateMobileMenuStatus(initial);
 
     refreshDashboard();
-    setInterval(refreshDashboard, 10000);
+    startLiveStream();
+    setInterval(() => {
+        if (!streamAlive) refreshDashboard();
+    }, 10000);
 });
\ No newline at end of file
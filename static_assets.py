@@ -0,0 +1,58 @@
+# static_assets.py
+
+import hashlib
+import os
+
+# Asset precaricati dal service worker con URL versionato
+PRECACHE_ASSETS = [
+    "css/dashboard.css",
+    "js/dashboard.js",
+    "img/logoLight.png",
+    "img/logoDark.png",
+]
+
+# Precaricati con URL fisso: li usano manifest PWA e notifiche push
+PRECACHE_FIXED = [
+    "img/icon-192.png",
+    "img/icon-512.png",
+]
+
+# Asset con ?v=hash corrente: il browser li tiene un anno senza rivalidare
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+class AssetManifest:
+    """
+    Manifest degli asset statici { percorso relativo : hash del contenuto },
+    costruito una volta all'avvio. Gli URL versionati cambiano solo quando
+    cambia il file, quindi possono essere messi in cache per sempre.
+    """
+
+    def __init__(self, static_dir):
+        self.hashes = {}
+        for root, _, files in os.walk(static_dir):
+            for filename in files:
+                path = os.path.join(root, filename)
+                rel = os.path.relpath(path, static_dir).replace(os.sep, "/")
+                with open(path, "rb") as f:
+                    self.hashes[rel] = hashlib.sha256(f.read()).hexdigest()[:12]
+
+        # Versione della cache del service worker: cambia con qualunque asset
+        digest = hashlib.sha256()
+        for rel in sorted(self.hashes):
+            digest.update(f"{rel}:{self.hashes[rel]}\n".encode())
+        self.version = digest.hexdigest()[:12]
+
+    def url(self, rel):
+        """URL versionato di un asset (senza versione se non è nel manifest)."""
+        h = self.hashes.get(rel)
+        return f"/static/{rel}?v={h}" if h else f"/static/{rel}"
+
+    def is_current(self, rel, version):
+        """True se `version` è l'hash attuale dell'asset."""
+        return version is not None and self.hashes.get(rel) == version
+
+    def precache_urls(self):
+        return [self.url(rel) for rel in PRECACHE_ASSETS] + [
+            f"/static/{rel}" for rel in PRECACHE_FIXED
+        ]
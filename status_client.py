@@ -1,78 +1,36 @@
 # status_client.py
 
 import requests
-from config import STATUS_URL, STATUS_TOKEN, PROBE_BG, PROBE_TIM, PROBE_ILIAD, PROBE_NODEPING
-from redis_history import load_history
+from config import STATUS_URL, STATUS_TOKEN, STATUS_TIMEOUT
+from kuma_client import normalize
+from metrics import UPSTREAM_FETCH, UPSTREAM_ERRORS
 
 
-def load_status():
+@UPSTREAM_FETCH.labels("status").time()
+def load_status(timeout=STATUS_TIMEOUT):
     try:
         r = requests.post(
             STATUS_URL,
             headers={"Authorization": f"Bearer {STATUS_TOKEN}"},
-            timeout=8,
+            timeout=timeout,
         )
         r.raise_for_status()
         return r.json() or {}
     except:
+        UPSTREAM_ERRORS.labels("status").inc()
         return {}
 
 
-def process_monitor(monitor_name, status_dict, name_norm):
-    history = load_history(name_norm)
+def index_status(status_dict):
+    """
+    Indicizza il payload dello status server per nome monitor normalizzato
+    (stessa normalizzazione di kuma_client): { name_norm : entry }.
+    A parità di nome vale la prima entry, come nella ricerca lineare.
+    """
+    index = {}
+    for data in (status_dict or {}).values():
+        last_name = data.get("last_name")
+        if last_name:
+            index.setdefault(normalize(last_name), data)
+    return index
 
-    if not status_dict:
-        return {
-            "bg": 1,
-            "tim": 1,
-            "iliad": 1,
-            "nodeping": 1,
-            "final": 1,
-            "severity": 0,
-            "history": history,
-        }
-
-    info = None
-    for url, data in status_dict.items():
-        if data.get("last_name") == monitor_name:
-            info = data
-            break
-
-    if not info:
-        return {
-            "bg": 1,
-            "tim": 1,
-            "iliad": 1,
-            "nodeping": 1,
-            "final": 1,
-            "severity": 0,
-            "history": history,
-        }
-
-    probes = info.get("probes", [])
-
-    bg_state  = 0 if PROBE_BG  in probes else 1
-    tim_state = 0 if PROBE_TIM in probes else 1
-    iliad_state = 0 if PROBE_ILIAD in probes else 1
-    nodeping_state = 0 if PROBE_NODEPING in probes else 1
-
-    final_state = 0 if (bg_state == 0 and tim_state == 0 and iliad_state == 0 and nodeping_state == 0) else 1
-
-    all_states = { bg_state, tim_state, iliad_state, nodeping_state }
-
-    if bg_state == 1 and tim_state == 1 and iliad_state == 1 and nodeping_state == 1:
-        severity = 0
-    elif len(all_states) > 1:
-        severity = 1
-    else:
-        severity = 2
-
-    return {
-        "bg": bg_state,
-        "tim": tim_state,
-        "iliad": iliad_state,
-        "nodeping": nodeping_state,
-        "final": final_state,
-        "severity": severity,
-        "history": history,
-    }
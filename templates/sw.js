@@ -3,12 +3,17 @@
  * ---------------------------------------------------------------
  * ✔ Forza Safari a caricare il nuovo file (bug fix)
  * ✔ Non cachea MAI HTML
- * ✔ Non cachea MAI richieste con query (?t=…)
+ * ✔ Non cachea MAI richieste con query (?t=…), salvo /static/*?v=hash
  * ✔ Cache-first SOLO per file statici /static/*
  * ✔ Gestione WebPush
+ *
+ * Generato da app.py: nome cache e precache vengono dal manifest
+ * degli asset (hash dei contenuti), quindi cambiano solo quando
+ * cambia un file statico.
  ********************************************************************/
 
-const STATIC_CACHE = "static-v6";
+const STATIC_CACHE = "static-{{ cache_version }}";
+const PRECACHE = {{ precache|tojson }};
 
 /* ---------------------------------------------------------------
  * INSTALL – Precache degli asset statici
@@ -16,14 +21,7 @@ const STATIC_CACHE = "static-v6";
 self.addEventListener("install", (event) => {
   event.waitUntil(
     caches.open(STATIC_CACHE).then((cache) => {
-      return cache.addAll([
-        "/static/css/dashboard.css",
-        "/static/js/dashboard.js",
-        "/static/img/logoLight.png",
-        "/static/img/logoDark.png",
-        "/static/img/icon-192.png",
-        "/static/img/icon-512.png"
-      ]);
+      return cache.addAll(PRECACHE);
     })
   );
 });
@@ -47,6 +45,23 @@ self.addEventListener("activate", (event) => {
 self.addEventListener("fetch", (event) => {
   const url = new URL(event.request.url);
 
+  // Static assets → cache-first (?v=hash: ogni versione è un file diverso)
+  if (url.pathname.startsWith("/static/")) {
+    event.respondWith(
+      caches.open(STATIC_CACHE).then((cache) =>
+        cache.match(event.request).then((cached) => {
+          if (cached) return cached;
+
+          return fetch(event.request).then((resp) => {
+            cache.put(event.request, resp.clone());
+            return resp;
+          });
+        })
+      )
+    );
+    return;
+  }
+
   // Query → rete sempre
   if (url.search.length > 0) {
     event.respondWith(fetch(event.request));
@@ -65,23 +80,6 @@ self.addEventListener("fetch", (event) => {
     return;
   }
 
-  // Static assets → cache-first
-  if (url.pathname.startsWith("/static/")) {
-    event.respondWith(
-      caches.open(STATIC_CACHE).then((cache) =>
-        cache.match(event.request).then((cached) => {
-          if (cached) return cached;
-
-          return fetch(event.request).then((resp) => {
-            cache.put(event.request, resp.clone());
-            return resp;
-          });
-        })
-      )
-    );
-    return;
-  }
-
   // Default → rete
   event.respondWith(fetch(event.request));
 });
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 import json
 from pywebpush import webpush, WebPushException
-from push_utils import load_subscriptions, save_subscriptions
+from push_utils import load_subscriptions, remove_subscriptions
 from config import PUSH_VAPID_PRIVATE_KEY, PUSH_VAPID_PUBLIC_KEY, PUSH_VAPID_CLAIMS
 
 # --------------------------------------------------------------
@@ -80,7 +80,7 @@ def main():
     # Pulizia subscription non valide
     if dead:
         print(f"\n🗑 Rimuovo {len(dead)} subscription morte.")
-        save_subscriptions([s for s in subs if s not in dead])
+        remove_subscriptions([s["endpoint"] for s in dead])
 
 
 if __name__ == "__main__":
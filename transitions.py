@@ -0,0 +1,107 @@
+# transitions.py
+
+import json
+import time
+
+from config import MONITOR_CONFIRM_CYCLES, MONITOR_FLAP_WINDOW, MONITOR_FLAP_THRESHOLD
+from redis_history import r, write_pipeline, execute_writes
+
+# ------------------ TRANSIZIONI PER MONITOR ------------------ #
+#
+# Stato per monitor nell'hash `transitions:state` { name_norm : JSON }:
+#   sev       severità confermata (ultima notificata)
+#   last      severità dell'ultimo ciclo
+#   cand      severità candidata in attesa di conferma (None se nessuna)
+#   count     cicli consecutivi della candidata
+#   flips     istanti dei cambi di stato nella finestra di flapping
+#   flapping  True se il monitor è instabile (eventi soppressi)
+#
+# Ogni ciclo vengono elaborati solo i monitor cambiati o con una
+# transizione in sospeso; si riscrivono solo i loro stati.
+
+_STATE_KEY = "transitions:state"
+
+
+def _event(kind, name_norm, old, new, ts):
+    return {"type": kind, "name": name_norm, "from": old, "to": new, "ts": ts}
+
+
+def _step(st, sev, name_norm, now):
+    """Applica la severità del ciclo allo stato. Ritorna l'evento o None."""
+    if sev != st["last"]:
+        st["flips"].append(now)
+    st["flips"] = [t for t in st["flips"] if t > now - MONITOR_FLAP_WINDOW]
+    st["last"] = sev
+
+    if st["flapping"]:
+        # Instabile finché nella finestra ci sono cambi di stato
+        if st["flips"]:
+            return None
+        old = st["sev"]
+        st.update(flapping=False, sev=sev, cand=None, count=0)
+        return _event("stable", name_norm, old, sev, now)
+
+    if len(st["flips"]) >= MONITOR_FLAP_THRESHOLD:
+        st.update(flapping=True, cand=None, count=0)
+        return _event("flapping", name_norm, st["sev"], sev, now)
+
+    if sev == st["sev"]:
+        st.update(cand=None, count=0)
+        return None
+
+    if st["cand"] == sev:
+        st["count"] += 1
+    else:
+        st.update(cand=sev, count=1)
+
+    if st["count"] >= MONITOR_CONFIRM_CYCLES:
+        old = st["sev"]
+        st.update(sev=sev, cand=None, count=0)
+        return _event("transition", name_norm, old, sev, now)
+    return None
+
+
+def detect_transitions(current, ts=None, fence=None):
+    """
+    Confronta le severità del ciclo { name_norm : severità } con lo stato
+    salvato e ritorna gli eventi per monitor:
+      transition  nuovo stato confermato per MONITOR_CONFIRM_CYCLES cicli
+      flapping    troppi cambi nella finestra: eventi sospesi
+      stable      fine del flapping, con lo stato corrente
+    Un monitor visto per la prima volta non genera eventi.
+    """
+    now = ts if ts is not None else time.time()
+    saved = r.hgetall(_STATE_KEY)
+
+    events = []
+    updates = {}
+
+    for name_norm, sev in current.items():
+        raw = saved.get(name_norm)
+        if raw is None:
+            updates[name_norm] = {
+                "sev": sev, "last": sev, "cand": None, "count": 0, "flips": [], "flapping": False,
+            }
+            continue
+
+        st = json.loads(raw)
+        # Invariato e nulla in sospeso → nessuna elaborazione
+        if sev == st["last"] and st["cand"] is None and not st["flapping"]:
+            continue
+
+        event = _step(st, sev, name_norm, now)
+        if event:
+            events.append(event)
+        updates[name_norm] = st
+
+    removed = [n for n in saved if n not in current]
+
+    if updates or removed:
+        pipe = write_pipeline(fence)
+        if updates:
+            pipe.hset(_STATE_KEY, mapping={n: json.dumps(st) for n, st in updates.items()})
+        if removed:
+            pipe.hdel(_STATE_KEY, *removed)
+        execute_writes(pipe, fence)
+
+    return events
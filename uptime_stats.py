@@ -0,0 +1,121 @@
+# uptime_stats.py
+
+import time
+from datetime import date, timedelta
+
+from config import UPTIME_RETENTION_DAYS
+from probes import PROBE_COLUMNS
+from redis_history import r, write_pipeline, execute_writes
+from metrics import REDIS_OP
+
+# ------------------ CONTATORI DI DISPONIBILITÀ ------------------ #
+#
+# Un hash per giorno (ora locale) con i secondi per stato:
+#   uptime:{AAAAMMGG}         campi "{name_norm}|up" / "|mismatch" / "|down"
+#   uptime:probes:{AAAAMMGG}  campi "{sonda}|up" / "|down" (secondi-monitor)
+# Un report su N giorni legge 2 hash per giorno, senza toccare lo storico.
+
+_STATES = ("up", "mismatch", "down")
+
+
+def _day(ts):
+    return time.strftime("%Y%m%d", time.localtime(ts))
+
+
+@REDIS_OP.labels("record_uptime").time()
+def record_uptime(rows_by_name, elapsed, ts=None, fence=None):
+    """
+    Aggiunge `elapsed` secondi ai contatori del giorno corrente per ogni
+    monitor { name_norm : riga } (stato dalla severità) e per ogni sonda.
+    """
+    if not rows_by_name or elapsed <= 0:
+        return
+    ts = ts if ts is not None else time.time()
+    day = _day(ts)
+    elapsed = int(round(elapsed))
+
+    monitors_key = f"uptime:{day}"
+    probes_key = f"uptime:probes:{day}"
+
+    probe_totals = {}
+    pipe = write_pipeline(fence, transaction=False)
+    for name_norm, row in rows_by_name.items():
+        pipe.hincrby(monitors_key, f"{name_norm}|{_STATES[row['severity']]}", elapsed)
+        for column, probe in PROBE_COLUMNS.items():
+            field = f"{probe}|{'down' if row[column] == 'DOWN' else 'up'}"
+            probe_totals[field] = probe_totals.get(field, 0) + elapsed
+
+    for field, seconds in probe_totals.items():
+        pipe.hincrby(probes_key, field, seconds)
+
+    expire = UPTIME_RETENTION_DAYS * 86400
+    pipe.expire(monitors_key, expire)
+    pipe.expire(probes_key, expire)
+    execute_writes(pipe, fence)
+
+
+def _percentages(seconds):
+    total = sum(seconds.values())
+    pct = {s: round(100.0 * v / total, 4) if total else None for s, v in seconds.items()}
+    return {"seconds": seconds, "percent": pct}
+
+
+@REDIS_OP.labels("uptime_report").time()
+def uptime_report(start, end, names=None):
+    """
+    Disponibilità per monitor e per sonda tra i giorni `start` e `end`
+    (date, estremi inclusi). `names` limita il report ad alcuni monitor.
+    La finestra è limitata ai giorni conservati (UPTIME_RETENTION_DAYS fino
+    a oggi); il report riporta gli estremi effettivi.
+    Costo O(giorni): due letture per giorno.
+    """
+    today = date.today()
+    start = max(start, today - timedelta(days=UPTIME_RETENTION_DAYS))
+    end = min(end, today)
+
+    days = []
+    d = start
+    while d <= end:
+        days.append(d.strftime("%Y%m%d"))
+        d += timedelta(days=1)
+
+    fields = [f"{n}|{s}" for n in names for s in _STATES] if names else None
+    pipe = r.pipeline(transaction=False)
+    for day in days:
+        if fields:
+            pipe.hmget(f"uptime:{day}", fields)
+        else:
+            pipe.hgetall(f"uptime:{day}")
+        pipe.hgetall(f"uptime:probes:{day}")
+    results = pipe.execute()
+
+    monitors = {}
+    probes = {}
+    for i in range(len(days)):
+        day_monitors, day_probes = results[2 * i], results[2 * i + 1]
+
+        if fields:
+            day_monitors = {f: v for f, v in zip(fields, day_monitors) if v is not None}
+
+        for field, value in day_monitors.items():
+            name_norm, _, state = field.rpartition("|")
+            counters = monitors.setdefault(name_norm, dict.fromkeys(_STATES, 0))
+            counters[state] += int(value)
+
+        for field, value in day_probes.items():
+            probe, _, state = field.rpartition("|")
+            counters = probes.setdefault(probe, {"up": 0, "down": 0})
+            counters[state] += int(value)
+
+    return {
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "monitors": {n: _percentages(c) for n, c in sorted(monitors.items())},
+        "probes": {p: _percentages(c) for p, c in sorted(probes.items())},
+    }
+
+
+def month_start(today=None):
+    """Primo giorno del mese corrente (default dei report)."""
+    today = today or date.today()
+    return today.replace(day=1)